@@ -3,11 +3,21 @@ from fastapi import HTTPException
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 from typing import Optional, Dict, Any
 
+# Fields of a study_graph_nodes document returned by the API
+NODE_FIELDS = ("node_id", "name", "position", "prerequisites", "dependents")
+
+
+def _node(document: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: document.get(field) for field in NODE_FIELDS}
+
+
 class GraphController:
     def __init__(self, db):
         """Initialize the controller with database connection"""
         self.db = db
         self.collection = self.db["test1"]
+        self.nodes = self.db["study_graph_nodes"]
+        self.edges = self.db["study_graph_edges"]
 
     async def get_graph_by_id(self, id: str) -> Dict[str, Any]:
         """
@@ -53,3 +63,99 @@ class GraphController:
             raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    async def get_nodes(self, student_id: int, project_name: str, skip: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """
+        List the nodes of a study graph in sequence order, with pagination
+        """
+        try:
+            scope = {"student_id": student_id, "project_name": project_name}
+            total = await self.nodes.count_documents(scope)
+            cursor = self.nodes.find(scope, {field: 1 for field in NODE_FIELDS}).sort("position", 1).skip(skip).limit(limit)
+            documents = await cursor.to_list(length=limit)
+
+            return {"total": total, "skip": skip, "limit": limit, "nodes": [_node(doc) for doc in documents]}
+
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    async def _graph_lookup(self, student_id: int, project_name: str, node_id: str, field: str,
+                            max_depth: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Runs $graphLookup from a node along one of its adjacency arrays
+        (prerequisites, dependents or neighbors). Returns the start node and
+        the reached nodes, each with the number of hops needed to reach it.
+        """
+        scope = {"student_id": student_id, "project_name": project_name}
+        graph_lookup = {
+            "from": "study_graph_nodes",
+            "startWith": f"${field}",
+            "connectFromField": field,
+            "connectToField": "node_id",
+            "as": "reached",
+            "depthField": "depth",
+            "restrictSearchWithMatch": scope,
+        }
+        if max_depth is not None:
+            graph_lookup["maxDepth"] = max_depth
+        documents = await self.nodes.aggregate([
+            {"$match": {**scope, "node_id": node_id}},
+            {"$graphLookup": graph_lookup},
+        ]).to_list(length=1)
+
+        if not documents:
+            raise HTTPException(status_code=404, detail=f"Node {node_id} not found in project {project_name}")
+
+        start = documents[0]
+        reached = [
+            {**_node(doc), "hops": doc["depth"] + 1}
+            for doc in start["reached"] if doc["node_id"] != node_id
+        ]
+        reached.sort(key=lambda node: (node["hops"], node["position"]))
+        return {"node": _node(start), "reached": reached}
+
+    async def get_prerequisites(self, student_id: int, project_name: str, node_id: str,
+                                max_depth: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Get every node that must be studied before a node, directly or
+        transitively, closest first
+        """
+        try:
+            result = await self._graph_lookup(student_id, project_name, node_id, "prerequisites",
+                                              None if max_depth is None else max_depth - 1)
+            return {"node": result["node"], "prerequisites": result["reached"]}
+
+        except HTTPException:
+            raise
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+
+    async def get_neighborhood(self, student_id: int, project_name: str, node_id: str, hops: int = 1) -> Dict[str, Any]:
+        """
+        Get the subgraph of the nodes at most `hops` edges away from a node,
+        following edges in either direction, with the edges between them
+        """
+        try:
+            result = await self._graph_lookup(student_id, project_name, node_id, "neighbors", hops - 1)
+            nodes = [{**result["node"], "hops": 0}] + result["reached"]
+            ids = [node["node_id"] for node in nodes]
+
+            cursor = self.edges.find(
+                {"student_id": student_id, "project_name": project_name,
+                 "source": {"$in": ids}, "target": {"$in": ids}},
+                {"_id": 0, "source": 1, "target": 1}
+            )
+            edges = [[edge["source"], edge["target"]] async for edge in cursor]
+
+            return {"node_id": node_id, "hops": hops, "nodes": nodes, "edges": edges}
+
+        except HTTPException:
+            raise
+        except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+            raise HTTPException(status_code=503, detail=f"Database connection error: {str(e)}")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
@@ -11,6 +11,48 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+@router.get("/students/{student_id}/projects/{project_name}/nodes", response_model=Dict[str, Any])
+async def get_graph_nodes(
+    student_id: int,
+    project_name: str,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncIOMotorDatabase = Depends(get_testdb)
+):
+    """
+    Get the nodes of a student's study graph in sequence order, with pagination
+    """
+    controller = GraphController(db)
+    return await controller.get_nodes(student_id, project_name, skip, limit)
+
+@router.get("/students/{student_id}/projects/{project_name}/nodes/{node_id}/prerequisites", response_model=Dict[str, Any])
+async def get_node_prerequisites(
+    student_id: int,
+    project_name: str,
+    node_id: str,
+    max_depth: Optional[int] = Query(None, ge=1),
+    db: AsyncIOMotorDatabase = Depends(get_testdb)
+):
+    """
+    Get the direct and transitive prerequisites of a node, up to `max_depth` edges away
+    """
+    controller = GraphController(db)
+    return await controller.get_prerequisites(student_id, project_name, node_id, max_depth)
+
+@router.get("/students/{student_id}/projects/{project_name}/nodes/{node_id}/neighborhood", response_model=Dict[str, Any])
+async def get_node_neighborhood(
+    student_id: int,
+    project_name: str,
+    node_id: str,
+    hops: int = Query(1, ge=1, le=10),
+    db: AsyncIOMotorDatabase = Depends(get_testdb)
+):
+    """
+    Get the subgraph within `hops` edges of a node (k-hop neighborhood)
+    """
+    controller = GraphController(db)
+    return await controller.get_neighborhood(student_id, project_name, node_id, hops)
+
 @router.get("/{graph_id}", response_model=Dict[str, Any])
 async def get_graph_by_id(
     graph_id: str,
@@ -1,18 +1,16 @@
 import os
 import sys
-import time
 import uuid
 import fitz
 import shutil
-from google import genai
 from dotenv import load_dotenv
-from pymongo.server_api import ServerApi
-from pymongo.mongo_client import MongoClient
 
-from google.genai.types import EmbedContentConfig
 from fastapi import APIRouter, File, UploadFile, HTTPException
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'src')))
+from embeddings import EMBEDDING_MODEL, embed_texts
+from db.client import MongoDBClient
 
 # from ...src.config import COLLECTIONS_DIR, SEGMENT_SIZE, GEMINI_EMB_MODEL, GOOGLE_API_KEY
 # from ...src.db.client import MongoDBClient
@@ -31,7 +29,6 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 dIM = 384  # embedding dim of all-MiniLM-L6-v2
 INDEX_PATH = os.getenv("INDEX_PATH", "faiss.index")
 
-GEMINI_EMB_MODEL = os.getenv("GEMINI_EMB_MODEL", "gemini-embedding-exp-03-07")
 GEMINI_CHAT_MODEL=os.getenv("GEMINI_CHAT_MODEL", "gemini-2.0-flash-001")
 SEGMENT_SIZE = int(os.getenv("SEGMENT_SIZE", 1000))
 
@@ -45,8 +42,6 @@ def generate_student_id():
     return int(uuid.uuid4().hex)
 
 
-gemini_ai_client = genai.Client(api_key=GOOGLE_API_KEY)
-
 def ingest_pdfs(std_id: int, project_name: str, folder_path=COLLECTIONS_DIR):
     """
     Ingest all PDFs, split into segments, embed via GenAI, and store in MongoDB.
@@ -57,12 +52,8 @@ def ingest_pdfs(std_id: int, project_name: str, folder_path=COLLECTIONS_DIR):
       folder_path: path to PDF folder
     """
     folder_path = os.path.join(folder_path, project_name)
-    db_client = MongoClient(
-        os.getenv("MONGODB_URI"),
-        server_api=ServerApi("1")
-    )
-    db = db_client[os.getenv("MONGODB_DB_NAME")]
-    segments_col = db["documents_segments"]
+    db_client = MongoDBClient()
+    segments_col = db_client.select_collection("documents_segments")
 
     files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
 
@@ -74,38 +65,41 @@ def ingest_pdfs(std_id: int, project_name: str, folder_path=COLLECTIONS_DIR):
             page = doc.load_page(page_num)
             page_text = page.get_text()
 
+            page_segments = []
             for idx in range(0, len(page_text), SEGMENT_SIZE):
-                time.sleep(0.5)
                 seg_text = page_text[idx: idx + SEGMENT_SIZE].strip()
                 print("Segment text:", seg_text)
                 if not seg_text:
                     continue
-                # Generate embedding
-                resp = gemini_ai_client.models.embed_content(
-                    model=GEMINI_EMB_MODEL,
-                    contents=[seg_text],
-                    config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT"),
-                )
-                vec = resp.embeddings[0].values
-
-                # Insert into MongoDB
-                doc_record = {
+                page_segments.append((idx // SEGMENT_SIZE, seg_text))
+            if not page_segments:
+                continue
+
+            # Embed the whole page in one batched call
+            vectors = embed_texts([seg_text for _, seg_text in page_segments],
+                                  task_type="RETRIEVAL_DOCUMENT")
+
+            # Insert into MongoDB
+            doc_records = []
+            for (segment_index, seg_text), vec in zip(page_segments, vectors):
+                doc_records.append({
                     "std_id": std_id,
                     "project_name": project_name,
                     "file_name": fname,
                     "page_number": page_num + 1,
-                    "segment_index": idx // SEGMENT_SIZE,
+                    "segment_index": segment_index,
                     "text": seg_text,
-                    "embedding": list(vec)
-                }
-                segments_col.insert_one(doc_record)
+                    "embedding": list(vec),
+                    "embedding_model": EMBEDDING_MODEL
+                })
+            segments_col.insert_many(doc_records)
         doc.close()
 
     # Update student knowledge base record
-    students_col = db.select_collection("test1")
+    students_col = db_client.select_collection("test1")
     students_col.update_one(
-        {"std_id": std_id},
-        {"$set": {"project_name": project_name, "files": files}},
+        {"student_id": std_id, "project_name": project_name},
+        {"$set": {"files": files}},
         upsert=True
     )
     print(f"Ingested {len(files)} files for student {std_id} in project '{project_name}'")
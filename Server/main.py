@@ -1,9 +1,11 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
 import logging
 import os
 import importlib.util
+import json
 import sys
 from dotenv import load_dotenv
 from app.routers import lens, testdb_router, upload
@@ -11,10 +13,14 @@ from app.db.mongodb import get_mongo_client
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from pydantic import BaseModel
+from typing import Optional
 
 # Add the parent directory to sys.path to allow imports from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from src.agents.keywords_finder_agent.agent import call_agent
+from src.agents.keywords_finder_agent.agent import call_agent, stream_agent
+from src.vector_search import invalidate_known_topics
+from singleflight import coalescing_stats
+from db.client import close_all as close_shared_mongo_clients
 
 # Load environment variables from .env file
 load_dotenv()
@@ -35,9 +41,14 @@ app = FastAPI(title="Keywords Finder API")
 
 class TextRequest(BaseModel):
     text: str
+    user_id: Optional[str] = None
+    student_id: Optional[int] = None
+    project_name: Optional[str] = None
 
 class StudyRequest(BaseModel):
     keyword: str
+    student_id: Optional[int] = None
+    project_name: Optional[str] = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -118,16 +129,43 @@ async def startup_db_client():
 
 
 @app.post("/keywords")
-async def extract_keywords(request: TextRequest):
+def extract_keywords(request: TextRequest):
     """
-    Extract keywords from the provided text using the agent
+    Extract keywords from the provided text using the agent.
+    Runs in the threadpool so concurrent identical requests can be coalesced.
     """
     try:
-        result = call_agent(request.text)
+        result = call_agent(request.text, user_id=request.user_id,
+                            student_id=request.student_id, project_name=request.project_name)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calling agent: {str(e)}")
 
+@app.post("/keywords/stream")
+def stream_keywords(request: TextRequest):
+    """
+    Same pipeline as /keywords, streamed as Server-Sent Events: known_topics,
+    keywords, one related_documents event per keyword, then done.
+    Failures are sent as an error event, since the response has already started.
+    """
+    def events():
+        try:
+            for stage, data in stream_agent(request.text, user_id=request.user_id,
+                                            student_id=request.student_id, project_name=request.project_name):
+                yield f"event: {stage}\ndata: {json.dumps(data, default=str)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'Error calling agent: {str(e)}'})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics/coalescing")
+async def get_coalescing_metrics():
+    """
+    Report how many embedding, search and agent calls were deduplicated
+    """
+    return coalescing_stats()
+
 @app.post("/simulate-study")
 async def simulate_study(request: StudyRequest):
     """
@@ -136,8 +174,10 @@ async def simulate_study(request: StudyRequest):
     try:
         # Connect to MongoDB
 
-        # Default to using the keywords collection
-        keyword = keywords_collection.find_one({"keyword": request.keyword})
+        # Default to using the keywords collection, in the student and project of the request
+        keyword_filter = {"student_id": request.student_id, "project_name": request.project_name,
+                          "keyword": request.keyword}
+        keyword = keywords_collection.find_one(keyword_filter)
 
         # Find the keyword in the database        
         current_level = keyword.get("knowledge_level", 0)
@@ -145,10 +185,11 @@ async def simulate_study(request: StudyRequest):
         
         # Update the knowledge level in the database
         result = keywords_collection.update_one(
-            {"keyword": request.keyword},
+            keyword_filter,
             {"$set": {"knowledge_level": new_level}}
         )
-        return {"success": True, "new_level": keywords_collection.find_one({"keyword": request.keyword})['knowledge_level']}
+        invalidate_known_topics(request.student_id, request.project_name)
+        return {"success": True, "new_level": keywords_collection.find_one(keyword_filter)['knowledge_level']}
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating knowledge level: {str(e)}")
@@ -166,6 +207,7 @@ async def shutdown_db_client():
     if client:
         client.close()
         logger.info("MongoDB connection closed")
+    close_shared_mongo_clients()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Latency comparison of the keywords pipeline modes with the LLM stubbed.
+
+Every LLM round trip is replaced by a stub that sleeps for --llm-latency
+seconds, the known-topics query sleeps for --db-latency seconds, and the
+embedding, vector search and other database calls are replaced by in-memory
+no-ops, so the measured difference is the number of LLM round trips on the
+critical path of each mode:
+
+    adk_sequential: known topics, extraction and saving agents one after the other (before)
+    adk:            known topics and extraction agents in parallel, then saving (after)
+    fast:           one structured extraction call, then saving
+
+Usage:
+    python benchmarks/keywords_pipeline_benchmark.py --runs 10 --llm-latency 0.8 --output keywords_bench.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+from datetime import datetime
+
+import numpy as np
+from google.adk.agents import SequentialAgent
+from google.adk.models.base_llm import BaseLlm
+from google.adk.runners import Runner
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "src"))
+from src.agents.keywords_finder_agent import agent
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("keywords_pipeline_benchmark")
+
+STUB_KEYWORDS = ["gradient descent", "learning rate", "loss function", "overfitting", "regularization"]
+
+
+class StubLlm(BaseLlm):
+    """
+    LLM stand-in with a fixed latency. Agents with tools get a call to their
+    tool first and a short text answer once the tool responded; agents with an
+    output schema get a canned KeywordsResponse.
+    """
+    latency: float = 0.5
+    calls: int = 0
+
+    async def generate_content_async(self, llm_request, stream=False):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+        last_parts = llm_request.contents[-1].parts if llm_request.contents else []
+        tool_answered = any(part.function_response for part in last_parts or [])
+        if llm_request.tools_dict and not tool_answered:
+            tool_name = next(iter(llm_request.tools_dict))
+            args = {"keywords_json": json.dumps(STUB_KEYWORDS)} if tool_name == "save_keywords_to_db" else {}
+            part = types.Part(function_call=types.FunctionCall(name=tool_name, args=args))
+        elif llm_request.config and llm_request.config.response_schema:
+            part = types.Part(text=json.dumps(stub_response().model_dump()))
+        else:
+            part = types.Part(text="done")
+        yield LlmResponse(content=types.Content(role="model", parts=[part]))
+
+
+class MemoryKeywordsCollection:
+    """No-op keywords collection: every keyword is new."""
+
+    def find(self, *args, **kwargs):
+        return []
+
+    def bulk_write(self, operations, ordered=True):
+        return None
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+    def index_information(self):
+        return {}
+
+
+def stub_response():
+    return agent.KeywordsResponse(keywords=STUB_KEYWORDS,
+                                  summaries=[f"Summary of {k}" for k in STUB_KEYWORDS])
+
+
+def llm_agents():
+    return [agent.get_known_topics_agent, agent.extract_keywords_agent, agent.save_keywords_agent]
+
+
+def install_stubs(latency, db_latency=0.0):
+    """Replace LLM, embedding, search and database calls of the agent module."""
+    stub_llm = StubLlm(model="stub-llm", latency=latency)
+    for sub_agent in llm_agents():
+        sub_agent.model = stub_llm
+
+    fast_calls = {"count": 0}
+
+    def stub_generate_structured(prompt, response_schema, model=None, system_instruction=None):
+        fast_calls["count"] += 1
+        time.sleep(latency)
+        return stub_response()
+
+    agent.generate_structured = stub_generate_structured
+    def stub_get_known_topics(threshold, student_id=None, project_name=None):
+        time.sleep(db_latency)
+        return [{"keyword": "linear algebra", "knowledge_level": 0.9}]
+
+    agent.get_known_topics = stub_get_known_topics
+    agent.generate_embeddings = lambda texts: [[0.0] * 8 for _ in texts]
+    agent.get_query_results_many = lambda queries, query_vectors=None, **filters: [[] for _ in queries]
+    agent.keywords_collection = MemoryKeywordsCollection()
+    agent.extraction_cache.lookup = lambda text: None
+    agent.extraction_cache.store = lambda *args, **kwargs: None
+    return stub_llm, fast_calls
+
+
+def sequential_runner():
+    """Runner over the former topology: the three agents in one SequentialAgent."""
+    legacy_agent = SequentialAgent(
+        name="keywords_sequential_agent_legacy",
+        sub_agents=[sub_agent.model_copy(update={"parent_agent": None}) for sub_agent in llm_agents()],
+    )
+    return Runner(agent=legacy_agent, app_name=agent.APP_NAME, session_service=agent.session_service)
+
+
+def run_mode(mode, runs, llm_counter):
+    latencies, llm_calls = [], []
+    for i in range(runs):
+        before = llm_counter()
+        t0 = time.perf_counter()
+        # Distinct texts so request coalescing never short-circuits a run
+        result = agent.call_agent(f"Benchmark passage {mode} {i} about training neural networks.",
+                                  mode="fast" if mode == "fast" else "adk")
+        latencies.append(time.perf_counter() - t0)
+        llm_calls.append(llm_counter() - before)
+        if not result:
+            raise RuntimeError(f"{mode} pipeline returned no keywords")
+
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "runs": runs,
+        "llm_round_trips_per_run": float(np.mean(llm_calls)),
+        "mean_ms": round(float(latencies_ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare keywords pipeline modes with the LLM stubbed")
+    parser.add_argument("--runs", type=int, default=10, help="Pipeline runs per mode")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="Seconds per stubbed LLM round trip")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="Seconds per known-topics query")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    stub_llm, fast_calls = install_stubs(args.llm_latency, args.db_latency)
+    counters = {
+        "adk_sequential": lambda: stub_llm.calls,
+        "adk": lambda: stub_llm.calls,
+        "fast": lambda: fast_calls["count"],
+    }
+
+    modes = {}
+    parallel_runner = agent.runner
+    for mode in ("adk_sequential", "adk", "fast"):
+        logger.info(f"Running {mode} pipeline {args.runs} times")
+        agent.runner = sequential_runner() if mode == "adk_sequential" else parallel_runner
+        modes[mode] = run_mode(mode, args.runs, counters[mode])
+    agent.runner = parallel_runner
+
+    report = {
+        "benchmark": "keywords_pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {"runs": args.runs, "llm_latency_s": args.llm_latency, "db_latency_s": args.db_latency},
+        "modes": modes,
+        "critical_path_p50_ms": {
+            "adk_before": modes["adk_sequential"]["p50_ms"],
+            "adk_after": modes["adk"]["p50_ms"],
+            "fast": modes["fast"]["p50_ms"],
+        },
+        "speedup_p50": round(modes["adk"]["p50_ms"] / modes["fast"]["p50_ms"], 2),
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        logger.info(f"Report written to {args.output}")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark over synthetic segment corpora.
+
+Generates corpora of document segments (1k to 1M rows, configurable embedding
+dimension), loads them into an in-memory store or a local MongoDB, and runs
+`retrieve`, `get_query_results` and the SegmentIndex engine against them.
+Latency percentiles, throughput, recall@k and the peak memory each engine
+allocates are written as JSON.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py --sizes 1000,10000,100000 --dim 768
+    python benchmarks/retrieval_benchmark.py --mongo-uri mongodb://localhost:27017/ --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.append(SRC_DIR)
+from documents.segment_index import SegmentIndex
+from embeddings import EMBEDDING_MODEL
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("retrieval_benchmark")
+
+PROJECT_NAME = "bench_project"
+
+
+# Rows of noise generated at a time, so the corpus is the only full-size float32 matrix
+CORPUS_CHUNK_ROWS = 65536
+
+
+def make_corpus(n_rows, dim, n_students=4, n_files=8, pages_per_file=50, n_clusters=64, seed=0):
+    """
+    Build a synthetic segment corpus drawn from a Gaussian mixture, so nearest
+    neighbours are meaningful and recall can be measured.
+    Returns (segments, embedding matrix). The matrix is float32 with unit rows,
+    built and normalized in place; segment embeddings are views of its rows.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal(size=(n_clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, n_clusters, size=n_rows)
+    matrix = centers[labels]
+    for start in range(0, n_rows, CORPUS_CHUNK_ROWS):
+        block = matrix[start:start + CORPUS_CHUNK_ROWS]
+        noise = rng.standard_normal(size=block.shape, dtype=np.float32)
+        noise *= 0.5
+        block += noise
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        block /= norms
+
+    rows = np.arange(n_rows)
+    std_ids = rows % n_students
+    file_ids = (rows // n_students) % n_files
+    page_numbers = (rows // (n_students * n_files)) % pages_per_file + 1
+
+    segments = []
+    for i in range(n_rows):
+        segments.append({
+            "_id": i,
+            "std_id": int(std_ids[i]),
+            "project_name": PROJECT_NAME,
+            "file_name": f"chapter-{file_ids[i] + 1}.pdf",
+            "page_number": int(page_numbers[i]),
+            "segment_index": 0,
+            "text": f"synthetic segment {i}",
+            "embedding": matrix[i],
+            "embedding_model": EMBEDDING_MODEL,
+        })
+    return segments, matrix
+
+
+def make_queries(matrix, n_queries, seed=1):
+    """Queries are random corpus rows perturbed by noise of norm about 0.1."""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, matrix.shape[0], size=n_queries)
+    queries = rng.standard_normal(size=(n_queries, matrix.shape[1]), dtype=np.float32)
+    queries *= 0.1 / np.sqrt(matrix.shape[1])
+    queries += matrix[picks]
+    return queries
+
+
+class MemorySegmentsCollection:
+    """
+    Minimal in-memory stand-in for the documents_segments collection.
+    Supports the filters produced by build_segment_filter in `find`,
+    `find_one` (sorted by _id), `count_documents` and a brute-force
+    `$vectorSearch` in `aggregate`. `matrix` rows must be unit-normalized, as
+    make_corpus returns them; it is used without a copy.
+    """
+
+    def __init__(self, segments, matrix):
+        self.segments = segments
+        self.normalized = matrix
+        self.columns = {
+            "std_id": np.array([s["std_id"] for s in segments]),
+            "project_name": np.array([s["project_name"] for s in segments]),
+            "file_name": np.array([s["file_name"] for s in segments]),
+            "page_number": np.array([s["page_number"] for s in segments]),
+            "embedding_model": np.array([s["embedding_model"] for s in segments]),
+        }
+
+    def _mask(self, filt):
+        mask = np.ones(len(self.segments), dtype=bool)
+        for field, cond in filt.items():
+            if field == "$and":
+                for clause in cond:
+                    mask &= self._mask(clause)
+                continue
+            column = self.columns[field]
+            if not isinstance(cond, dict):
+                cond = {"$eq": cond}
+            for op, value in cond.items():
+                if op == "$eq":
+                    mask &= column == value
+                elif op == "$in":
+                    mask &= np.isin(column, value)
+                elif op == "$gte":
+                    mask &= column >= value
+                elif op == "$lte":
+                    mask &= column <= value
+                else:
+                    raise ValueError(f"Unsupported operator {op}")
+        return mask
+
+    def _project(self, doc, projection):
+        if not projection:
+            return dict(doc)
+        keep = {k for k, v in projection.items() if v}
+        out = {k: v for k, v in doc.items() if k in keep}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+
+    def count_documents(self, filt):
+        return int(self._mask(filt).sum())
+
+    def find(self, filt=None, projection=None):
+        rows = np.flatnonzero(self._mask(filt or {}))
+        return [self._project(self.segments[i], projection) for i in rows]
+
+    def find_one(self, filt=None, projection=None, sort=None):
+        rows = np.flatnonzero(self._mask(filt or {}))
+        if not rows.size:
+            return None
+        # Segments are stored in _id order
+        row = rows[-1] if sort and sort[0][1] < 0 else rows[0]
+        return self._project(self.segments[row], projection)
+
+    def aggregate(self, pipeline):
+        stage = pipeline[0]["$vectorSearch"]
+        q_vec = np.asarray(stage["queryVector"], dtype='float32')
+        q_vec = q_vec / np.linalg.norm(q_vec)
+        rows = np.flatnonzero(self._mask(stage.get("filter", {})))
+        # Scoring every row and selecting the scores avoids copying the matching rows
+        scores = (self.normalized @ q_vec)[rows]
+        k = min(stage["limit"], rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        projection = pipeline[1]["$project"] if len(pipeline) > 1 else None
+        return iter([self._project(self.segments[rows[i]], projection) for i in top])
+
+
+def load_mongo_collection(mongo_uri, segments):
+    """Insert the corpus into a scratch collection of a local MongoDB."""
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri)
+    collection = client["edu25_benchmark"]["documents_segments"]
+    collection.drop()
+    batch = []
+    for seg in segments:
+        batch.append({**seg, "embedding": seg["embedding"].tolist()})
+        if len(batch) == 10000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    collection.create_index([("std_id", 1), ("project_name", 1)])
+    return collection
+
+
+def exact_top_k(scores, rows, k):
+    """Ground-truth neighbour ids for recall@k, among `rows`, from the scores of every row."""
+    scores = scores[rows]
+    k = min(k, rows.size)
+    return set(rows[np.argpartition(-scores, k - 1)[:k]].tolist())
+
+
+def fake_embed_text(query_vectors):
+    """Embedding stand-in returning the precomputed vector for query text 'q<i>'."""
+    def embed_text(text, task_type=None):
+        return query_vectors[int(text[1:])].tolist()
+    return embed_text
+
+
+# Queries run again under tracemalloc to measure an engine's peak memory
+MEMORY_QUERIES = 10
+
+
+def traced_peak_mb(run):
+    """
+    Peak memory allocated while `run()` executes, through Python or numpy,
+    above what was allocated when it started. Unlike the process peak RSS it
+    excludes the corpus and earlier engines. tracemalloc slows allocations,
+    so this runs outside the timed pass.
+    """
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def summarize(latencies, hits, k, total_seconds):
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "throughput_qps": round(len(latencies) / total_seconds, 2) if total_seconds else None,
+        f"recall_at_{k}": round(float(np.mean(hits)), 4),
+    }
+
+
+def run_engine(search, queries, truth, k):
+    """Run search(i) for every query and compare returned ids against truth."""
+    latencies, hits = [], []
+    started = time.perf_counter()
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        found = search(i)
+        latencies.append(time.perf_counter() - t0)
+        hits.append(len(set(found) & truth[i]) / max(len(truth[i]), 1))
+    return summarize(latencies, hits, k, time.perf_counter() - started)
+
+
+def bench_segment_index(segments, queries, truth, k, std_id):
+    t0 = time.perf_counter()
+    scoped = [seg for seg in segments if seg["std_id"] == std_id]
+    index = SegmentIndex(scoped)
+    build_ms = (time.perf_counter() - t0) * 1000.0
+    result = run_engine(lambda i: [seg["_id"] for _, seg in index.search(queries[i], top_k=k)],
+                        queries, truth, k)
+    result["index_build_ms"] = round(build_ms, 3)
+    return result
+
+
+def bench_retrieve(collection, queries, truth, k, std_id):
+    from documents import retriever
+
+    retriever.MongoDBClient = lambda: SimpleNamespace(select_collection=lambda name: collection)
+    retriever.embed_text = fake_embed_text(queries)
+    retriever.segment_index_cache.clear()
+
+    # Map result rows back to corpus ids through their unique text
+    def search(i):
+        return [int(r["text"].rsplit(" ", 1)[1]) for r in
+                retriever.retrieve(std_id, PROJECT_NAME, f"q{i}", top_k=k)]
+
+    t0 = time.perf_counter()
+    search(0)
+    cold_ms = (time.perf_counter() - t0) * 1000.0
+    result = run_engine(search, queries, truth, k)
+    result["cold_query_ms"] = round(cold_ms, 3)
+    return result
+
+
+def bench_get_query_results(collection, queries, truth, k):
+    import vector_search
+
+    vector_search.collection = collection
+    vector_search.get_embedding = fake_embed_text(queries)
+    return run_engine(lambda i: [doc["_id"] for doc in vector_search.get_query_results(f"q{i}", limit=k)],
+                      queries, truth, k)
+
+
+def run_size(n_rows, args):
+    logger.info(f"Generating corpus: rows={n_rows} dim={args.dim}")
+    segments, matrix = make_corpus(n_rows, args.dim, seed=args.seed)
+    queries = make_queries(matrix, args.queries, seed=args.seed + 1)
+
+    std_id = 0
+    scoped_rows = np.flatnonzero([seg["std_id"] == std_id for seg in segments])
+    all_rows = np.arange(n_rows)
+    scoped_truth, global_truth = [], []
+    for q in queries:
+        scores = matrix @ (q / np.linalg.norm(q))
+        scoped_truth.append(exact_top_k(scores, scoped_rows, args.k))
+        global_truth.append(exact_top_k(scores, all_rows, args.k))
+
+    if args.mongo_uri:
+        collection = load_mongo_collection(args.mongo_uri, segments)
+        store = "mongodb"
+    else:
+        collection = MemorySegmentsCollection(segments, matrix)
+        store = "memory"
+
+    # Each engine runs its first n queries, index build included
+    engines = {
+        "segment_index": lambda n: bench_segment_index(segments, queries[:n], scoped_truth[:n], args.k, std_id),
+        "retrieve": lambda n: bench_retrieve(collection, queries[:n], scoped_truth[:n], args.k, std_id),
+        "get_query_results": lambda n: bench_get_query_results(collection, queries[:n], global_truth[:n], args.k),
+    }
+    results = {}
+    for name in args.engines:
+        logger.info(f"Running {name} on {n_rows} rows")
+        try:
+            results[name] = engines[name](len(queries))
+            n = min(MEMORY_QUERIES, len(queries))
+            results[name]["peak_traced_mb"] = round(traced_peak_mb(lambda: engines[name](n)), 1)
+        except Exception as e:
+            logger.warning(f"{name} failed: {e}")
+            results[name] = {"error": str(e)}
+    return {"rows": n_rows, "dim": args.dim, "store": store, "engines": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval over synthetic segment corpora")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma-separated corpus sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per engine and size")
+    parser.add_argument("--k", type=int, default=5, help="Top-k for search and recall")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", default="segment_index,retrieve,get_query_results",
+                        help="Comma-separated engines to run")
+    parser.add_argument("--mongo-uri", default=None,
+                        help="Load corpora into this MongoDB instead of the in-memory store")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    args = parser.parse_args()
+    args.engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+
+    report = {
+        "benchmark": "retrieval",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {"dim": args.dim, "queries": args.queries, "k": args.k, "seed": args.seed},
+        "runs": [run_size(int(size), args) for size in args.sizes.split(",")],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        logger.info(f"Report written to {args.output}")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,6 +61,9 @@ def display_graph_data(document):
         print(colored(f"Current active file: {document.get('current_active_file', 'N/A')}", "cyan"))
         print(colored(f"{'=' * 80}\n", "cyan"))
 
+        # Node names by id, for the edges and the sequence
+        node_names = dict(zip(planning_graph.get("nodes_id", []), planning_graph.get("nodes", [])))
+
         # Display nodes
         print(colored("NODES:", "green", attrs=["bold"]))
         if "nodes" in planning_graph and "nodes_id" in planning_graph:
@@ -79,16 +82,11 @@ def display_graph_data(document):
                 if len(edge) == 2:
                     source_id, target_id = edge
                     # Get node names if available
-                    try:
-                        source_idx = planning_graph["nodes_id"].index(source_id)
-                        target_idx = planning_graph["nodes_id"].index(target_id)
-                        source_name = planning_graph["nodes"][source_idx]
-                        target_name = planning_graph["nodes"][target_idx]
-
-                        print(colored(f"  • {source_name}", "blue") +
+                    if source_id in node_names and target_id in node_names:
+                        print(colored(f"  • {node_names[source_id]}", "blue") +
                               colored(" → ", "yellow") +
-                              colored(f"{target_name}", "blue"))
-                    except (ValueError, IndexError):
+                              colored(f"{node_names[target_id]}", "blue"))
+                    else:
                         print(colored(f"  • {source_id} → {target_id}", "blue"))
         else:
             print(colored("  No edges found.", "yellow"))
@@ -99,12 +97,10 @@ def display_graph_data(document):
         if "sequence" in planning_graph:
             print(colored("SEQUENCE:", "magenta", attrs=["bold"]))
             for i, node_id in enumerate(planning_graph["sequence"], 1):
-                try:
-                    idx = planning_graph["nodes_id"].index(node_id)
-                    node_name = planning_graph["nodes"][idx]
-                    print(colored(f"  {i}. {node_name}", "magenta") +
+                if node_id in node_names:
+                    print(colored(f"  {i}. {node_names[node_id]}", "magenta") +
                           colored(f" (ID: {node_id})", "grey"))
-                except (ValueError, IndexError):
+                else:
                     print(colored(f"  {i}. {node_id}", "magenta"))
 
         print("\n")
@@ -2,29 +2,13 @@ import os
 from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from google import genai
-from config import GOOGLE_API_KEY
+from embeddings import EMBEDDING_MODEL, embed_texts
 
 
 # Function to create embedding with Gemini
 def generate_embeddings(texts):
-    """Generate embeddings for a list of texts using Google's Gemini model."""
-    # Initialize the genai client
-    genai_client = genai.Client(api_key=GOOGLE_API_KEY)
-    
-    # Generate embeddings
-    embeddings = []
-    for text in texts:
-        result = genai_client.models.embed_content(
-            model="gemini-embedding-exp-03-07",
-            contents=text
-        )
-
-        # Extract the values from the ContentEmbedding object
-        embedding_values = result.embeddings[0].values
-        embeddings.append(embedding_values)
-    
-    return embeddings
+    """Generate embeddings for a list of texts using the shared embedding service."""
+    return embed_texts(texts)
 
 # Function to create documents with embeddings
 def create_docs_with_embeddings(embeddings, data):
@@ -35,6 +19,7 @@ def create_docs_with_embeddings(embeddings, data):
             "_id": i,
             "text": text,
             "embedding": embedding,
+            "embedding_model": EMBEDDING_MODEL,
         }
         docs.append(doc)
 
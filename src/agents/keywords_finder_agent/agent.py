@@ -3,27 +3,50 @@ from pydantic import BaseModel, Field
 from typing import List, Dict, Any
 import json
 import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from google import genai
 from datetime import datetime
 from google.adk.runners import Runner
+from google.adk.events import Event, EventActions
+from google.adk.tools import ToolContext
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
 
 import sys
 
+from ..session_pool import SessionPool
+from .extraction_cache import ExtractionCache
+from .map_reduce import split_text, merge_extractions
+
 # Add the parent directory to sys.path to import modules from src
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from src.vector_search import get_query_results, get_known_topics
+from src.vector_search import get_query_results_many, iter_query_results, get_known_topics
+from embeddings import EMBEDDING_MODEL, embed_texts
+from singleflight import get_group, make_key
+from llm import generate_structured
 
 # Load environment variables
 load_dotenv("../../.env")
 
 APP_NAME="graph_sequential_agent"
-USER_ID="user1234"
-SESSION_ID="1234"
+
+# "fast": saving runs as plain Python after one structured extraction call.
+# "adk": the ADK agent pipeline (known topics and extraction in parallel, then saving).
+KEYWORDS_PIPELINE_MODE = os.getenv("KEYWORDS_PIPELINE_MODE", "fast")
+
+# Fast pipeline inputs longer than KEYWORDS_CHUNK_CHARS are extracted chunk by chunk in parallel
+KEYWORDS_CHUNK_CHARS = int(os.getenv("KEYWORDS_CHUNK_CHARS", 8000))
+KEYWORDS_CHUNK_OVERLAP = int(os.getenv("KEYWORDS_CHUNK_OVERLAP", 200))
+KEYWORDS_CHUNK_CONCURRENCY = int(os.getenv("KEYWORDS_CHUNK_CONCURRENCY", 8))
+# Keywords of different chunks at least this similar are merged
+KEYWORDS_MERGE_SIMILARITY = float(os.getenv("KEYWORDS_MERGE_SIMILARITY", 0.92))
+# Upper bound on the keywords kept from a chunked input
+KEYWORDS_MAX_MERGED = int(os.getenv("KEYWORDS_MAX_MERGED", 40))
 
 # Get MongoDB password and Google API key from environment variables
 mongodb_password = os.getenv("MONGODB_PASSWORD")
@@ -52,20 +75,11 @@ class KeywordsResponse(BaseModel):
 
 
 def generate_embeddings(texts):
-    """Generate embedding for a single text using Google's Gemini model."""
-    # Initialize the genai client
-    genai_client = genai.Client(api_key=google_api_key)
-    
-    # Generate embedding
-    result = genai_client.models.embed_content(
-        model="models/text-embedding-004",
-        contents=texts
-    )
-    
-    return [emb.values for emb in result.embeddings]
+    """Generate embeddings for a list of texts using the shared embedding service."""
+    return embed_texts(texts)
 
 
-def save_keywords_to_db(keywords_json: str) -> str:
+def save_keywords_to_db(keywords_json: str, tool_context: ToolContext) -> str:
     """
     Function to save keywords to MongoDB.
     Takes a List of keywords and saves them with their embeddings.
@@ -76,8 +90,10 @@ def save_keywords_to_db(keywords_json: str) -> str:
         # Parse the JSON string to get the keywords
         keywords = json.loads(keywords_json)
         
-        # Save keywords with embeddings to MongoDB
-        saved_count = save_keywords_with_embeddings(keywords)
+        # Save keywords with embeddings to MongoDB, in the student and project of the session
+        saved_count = save_keywords_with_embeddings(keywords,
+                                                    student_id=tool_context.state.get("student_id"),
+                                                    project_name=tool_context.state.get("project_name"))
         # print(f"Saved {saved_count} keywords with embeddings to MongoDB")
         
         # Return the original keywords with a success message
@@ -94,70 +110,140 @@ def save_keywords_to_db(keywords_json: str) -> str:
         })
 
 
-def save_keywords_with_embeddings(keywords):
-    """Save keywords and their embeddings to MongoDB."""
-    key_doc = []
-    key_doc_insert = []
-    all_related_documents = []
-    embeddings = generate_embeddings(keywords)
-    
-    for keyword, embedding in zip(keywords, embeddings):
-        # Check if keyword already exists in the database
-        existing_keyword = keywords_collection.find_one({"keyword": keyword})
-            
-        # Get the first 3 similar document segments for this keyword
-        related_documents = get_query_results(keyword)
-        for doc in related_documents:
-            del doc["_id"]
-        
-        # Create document with keyword, its embedding, and related documents
-        doc = {
-            "keyword": keyword,
-            "embedding": embedding,
-            "knowledge_level": 0.0,  # How much the keyword is known from 0 to 1
-            # "related_documents": related_documents,  # Store the first 3 similar documents
-            # "created_at": datetime.now()
-        }
-        if not existing_keyword:
-            key_doc_insert.append(doc)
-        else:
-            doc["knowledge_level"] = existing_keyword["knowledge_level"]
-        key_doc.append(doc)
-        all_related_documents.append(related_documents)
-
-    # Insert documents into the keywords collection
-    if key_doc_insert:
-        keywords_collection.insert_many(key_doc_insert)
+_keyword_indexes_ready = False
+
+
+def ensure_keyword_indexes():
+    """
+    Creates the unique index on (student_id, project_name, keyword) the bulk
+    upsert relies on, once per process. The former unique index on `keyword`
+    alone would stop two students from having the same keyword, so it is dropped.
+    """
+    global _keyword_indexes_ready
+    if _keyword_indexes_ready:
+        return
+    try:
+        if keywords_collection.index_information().get("keyword_1", {}).get("unique"):
+            keywords_collection.drop_index("keyword_1")
+        keywords_collection.create_index([("student_id", 1), ("project_name", 1), ("keyword", 1)], unique=True)
+    except OperationFailure as e:
+        # Existing duplicates must be cleaned up before the index can be built
+        print(f"Could not create unique keyword index: {e}")
+    _keyword_indexes_ready = True
+
+
+def save_keywords_with_embeddings(keywords, embeddings=None, student_id=None, project_name=None):
+    """
+    Save keywords and their embeddings to MongoDB, in the keywords of the
+    student and project (unscoped when both are None), and find their related documents.
+    Precomputed embeddings (one per keyword) skip the embedding call.
+    """
+    keywords, embeddings, existing_keywords = upsert_keywords(keywords, embeddings, student_id, project_name)
+
+    # Get the first 3 similar document segments for every keyword concurrently,
+    # reusing the keyword embeddings as query vectors
+    all_related_documents = get_query_results_many(keywords, query_vectors=embeddings,
+                                                   **related_documents_scope(student_id, project_name))
 
     docs = []
-    for related, doc in zip(all_related_documents, key_doc):
-        doc = {
-            "keyword": doc["keyword"],
-            "knowledge_level": doc["knowledge_level"],
-            "related_documents": related,
-        }
-        docs.append(doc)
+    for keyword, related in zip(keywords, all_related_documents):
+        docs.append(keyword_document(keyword, existing_keywords.get(keyword, 0.0), related))
     return {"success": True, "result": docs}
 
+
+def related_documents_scope(student_id=None, project_name=None):
+    """
+    Vector search filters restricting related documents to the segments of
+    the student and project; a missing part of the scope is not filtered on.
+    """
+    return {"std_id": student_id, "project_name": project_name}
+
+
+def keyword_document(keyword, knowledge_level, related_documents):
+    """Keyword entry returned to the client."""
+    for doc in related_documents:
+        doc.pop("_id", None)
+    return {
+        "keyword": keyword,
+        "knowledge_level": knowledge_level,
+        "related_documents": related_documents,
+    }
+
+
+def upsert_keywords(keywords, embeddings=None, student_id=None, project_name=None):
+    """
+    Inserts the keywords the student and project do not have yet.
+    Uses one $in lookup and one unordered bulk upsert, whatever the number of keywords.
+    Returns the deduplicated keywords, their embeddings and the knowledge level
+    of those that already existed.
+    """
+    scope = {"student_id": student_id, "project_name": project_name}
+    if embeddings is None:
+        # Drop duplicates returned by the LLM while keeping their order
+        keywords = list(dict.fromkeys(keywords))
+        embeddings = generate_embeddings(keywords)
+    else:
+        unique = dict(zip(keywords, embeddings))
+        keywords, embeddings = list(unique), list(unique.values())
+    ensure_keyword_indexes()
+
+    # Fetch the knowledge level of every keyword that already exists in one round trip
+    existing_keywords = {
+        doc["keyword"]: doc.get("knowledge_level", 0.0)
+        for doc in keywords_collection.find(
+            {**scope, "keyword": {"$in": keywords}},
+            {"_id": 0, "keyword": 1, "knowledge_level": 1}
+        )
+    }
+
+    # New keywords start at knowledge level 0, which never changes the known topics.
+    # Upsert new keywords; $setOnInsert leaves a keyword inserted concurrently untouched
+    operations = [
+        UpdateOne(
+            {**scope, "keyword": keyword},
+            {"$setOnInsert": {
+                **scope,
+                "keyword": keyword,
+                "embedding": embedding,
+                "embedding_model": EMBEDDING_MODEL,
+                "knowledge_level": 0.0,  # How much the keyword is known from 0 to 1
+            }},
+            upsert=True
+        )
+        for keyword, embedding in zip(keywords, embeddings)
+        if keyword not in existing_keywords
+    ]
+    if operations:
+        try:
+            keywords_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Two upserts racing on the same new keyword: the loser hits the unique index
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+    return keywords, embeddings, existing_keywords
+
 class KnowledgeLevelQuery(BaseModel):
     """Schema for the knowledge level threshold parameter."""
     knowledge_level_threshold: float = Field(description="The minimum knowledge level threshold (0.0 to 1.0)")
 
 
-def get_known_topics_with_threshold() -> str:
+def get_known_topics_with_threshold(tool_context: ToolContext) -> str:
     """
-    Wrapper function that calls get_known_topics.
+    Wrapper function that calls get_known_topics for the student and project of the session.
     Returns the results in JSON format.
     """
-    known_topics = get_known_topics(0.8)
+    known_topics = get_known_topics(0.8, tool_context.state.get("student_id"),
+                                    tool_context.state.get("project_name"))
     return json.dumps(known_topics)
 
+EXTRACT_KEYWORDS_INSTRUCTION = 'Extract the most important keywords from the provided text and a summary that explain the keywork meaning. Return only the keywords as a comma-separated list.'
+
 # Create extraction agent
 extract_keywords_agent = Agent(
     model='gemini-2.0-flash-001',
     name='extract_keywords_agent',
     description='An agent that extracts important keywords from text, generates summaries based on existing knowledge',
-    instruction='Extract the most important keywords from the provided text and a summary that explain the keywork meaning. Return only the keywords as a comma-separated list.',
+    instruction=EXTRACT_KEYWORDS_INSTRUCTION,
     output_schema=KeywordsResponse, # Enforce JSON output
     output_key="extracted_keywords",
 )
@@ -181,40 +267,210 @@ save_keywords_agent = Agent(
     tools=[save_keywords_to_db]
 )
 
-# parallel_research_agent = ParallelAgent(
-#     name="ParallelWebResearchAgent",
-#     sub_agents=[extract_keywords_agent, get_known_topics_agent],
-#     description="Runs multiple agents to extract keywords and knowledge levels."
-# )
+# Known topics and extraction do not depend on each other: run them concurrently
+parallel_research_agent = ParallelAgent(
+    name="ParallelWebResearchAgent",
+    sub_agents=[extract_keywords_agent, get_known_topics_agent],
+    description="Runs multiple agents to extract keywords and knowledge levels."
+)
 
 
-# Create sequential agent that combines both agents
+# Create sequential agent that joins both parallel outputs before saving
 root_agent = SequentialAgent(
     name='keywords_sequential_agent',
     description='A sequential agent that extracts keywords and saves them to the database.',
-    sub_agents=[get_known_topics_agent, extract_keywords_agent, save_keywords_agent]
+    sub_agents=[parallel_research_agent, save_keywords_agent]
 )
 
 
-# Session and Runner
+# Session and Runner: sessions are created per request or per user, see SessionPool
 session_service = InMemorySessionService()
-session = session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
+session_pool = SessionPool(session_service, APP_NAME)
 runner = Runner(agent=root_agent, app_name=APP_NAME, session_service=session_service)
 
 
+# Identical concurrent extraction requests share one pipeline run
+keywords_flight = get_group("keywords_agent")
+
+# Changes whenever the instruction or the response schema changes, so stale extractions are never served
+KEYWORDS_PROMPT_VERSION = hashlib.sha256(
+    (EXTRACT_KEYWORDS_INSTRUCTION + json.dumps(KeywordsResponse.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+
+# Extracted keywords per input text, across requests and restarts
+extraction_cache = ExtractionCache(db["keyword_extraction_cache"], extract_keywords_agent.model,
+                                   KEYWORDS_PROMPT_VERSION)
+
+
 # Agent Interaction
-def call_agent(text):
+def call_agent(text, mode=None, user_id=None, student_id=None, project_name=None):
     """
     Helper function to call the agent with a query.
+    mode is "fast" or "adk", defaulting to KEYWORDS_PIPELINE_MODE. In "adk" mode
+    user_id selects the user's pooled session; without it a single-use session is used.
+    student_id and project_name scope the known topics and saved keywords.
+    Concurrent calls with the same text and scope are coalesced into a single pipeline run.
+    Texts already extracted are served from the extraction cache in either mode.
+    """
+    mode = mode or KEYWORDS_PIPELINE_MODE
+    key = make_key(extract_keywords_agent.model, {"text": text, "mode": mode,
+                                                  "student_id": student_id, "project_name": project_name})
+    return keywords_flight.do(key, _call_agent, text, mode, user_id, student_id, project_name)
+
+
+def _call_agent(text, mode, user_id, student_id, project_name):
+    cached = extraction_cache.lookup(text)
+    if cached is not None:
+        print(f"Keyword extraction cache hit for input: {text[:100]}...")
+        return run_cached_pipeline(text, cached, student_id, project_name)
+    if mode == "adk":
+        return _run_agent(text, user_id, student_id, project_name)
+    return run_fast_pipeline(text, student_id, project_name)
+
+
+def run_cached_pipeline(text, cached, student_id=None, project_name=None):
+    """
+    Skips extraction: only the knowledge levels and related documents of the
+    cached keywords are refreshed. Cached embeddings of the current embedding
+    model are reused as query vectors.
+    """
+    return save_keywords_with_embeddings(cached["keywords"], _cached_embeddings(text, cached),
+                                         student_id, project_name)["result"]
+
+
+def _cached_embeddings(text, cached):
+    """
+    Embeddings of the cached keywords. Entries without embeddings of the
+    current model (ADK extractions, or a former model) get them computed once
+    and stored back, so later hits make no embedding call.
+    """
+    if cached.get("embedding_model") == EMBEDDING_MODEL and cached.get("embeddings") is not None:
+        return cached["embeddings"]
+    embeddings = generate_embeddings(cached["keywords"])
+    extraction_cache.store_embeddings(text, embeddings, EMBEDDING_MODEL)
+    return embeddings
+
+
+def extract_keywords(text: str) -> KeywordsResponse:
+    """
+    Single structured-output extraction call, same model and instruction as extract_keywords_agent.
+    """
+    return generate_structured(text, KeywordsResponse, model=extract_keywords_agent.model,
+                               system_instruction=EXTRACT_KEYWORDS_INSTRUCTION)
+
+
+def extract_keywords_chunked(text: str):
+    """
+    Map-reduce extraction for long inputs: chunks are extracted in parallel
+    (at most KEYWORDS_CHUNK_CONCURRENCY at a time), then their keywords are
+    deduplicated and ranked by merge_extractions. Short inputs take a single
+    extraction call.
+    Returns (keywords, summaries, embeddings).
+    """
+    chunks = split_text(text, KEYWORDS_CHUNK_CHARS, KEYWORDS_CHUNK_OVERLAP)
+    if len(chunks) == 1:
+        extracted = extract_keywords(text)
+        return extracted.keywords, extracted.summaries, generate_embeddings(extracted.keywords)
+
+    print(f"Extracting keywords from {len(chunks)} chunks")
+    with ThreadPoolExecutor(max_workers=min(KEYWORDS_CHUNK_CONCURRENCY, len(chunks))) as pool:
+        extractions = [(extracted.keywords, extracted.summaries)
+                       for extracted in pool.map(extract_keywords, chunks)]
+    return merge_extractions(extractions, generate_embeddings, KEYWORDS_MERGE_SIMILARITY,
+                             max_keywords=KEYWORDS_MAX_MERGED)
+
+
+def run_fast_pipeline(text, student_id=None, project_name=None):
+    """
+    Deterministic pipeline: saving is a plain function call, only the
+    extraction goes to the LLM. Returns the same saved keyword documents as
+    the ADK pipeline. Known topics are not loaded: nothing in the saved
+    result depends on them (stream_agent sends them to its client).
+    """
+    print(f"Starting fast keywords pipeline with input: {text[:100]}...")
+    keywords, summaries, embeddings = extract_keywords_chunked(text)
+    extraction_cache.store(text, keywords, summaries, embeddings, EMBEDDING_MODEL)
+    return save_keywords_with_embeddings(keywords, embeddings, student_id, project_name)["result"]
+
+
+def stream_agent(text, mode=None, user_id=None, student_id=None, project_name=None):
+    """
+    Streaming variant of call_agent: yields (stage, data) pairs while the pipeline runs.
+
+    Stages, in order:
+      "known_topics": {"known_topics": [...]} (not sent on extraction cache hits)
+      "keywords": {"keywords": [...], "summaries": [...], "cached": bool}
+      "related_documents": one saved keyword document per keyword, in completion order
+      "done": {"result": [...]} with the same documents call_agent returns
+
+    In "adk" mode the save tool resolves every related document before
+    returning, so those stages arrive together after the save.
+    """
+    mode = mode or KEYWORDS_PIPELINE_MODE
+    cached = extraction_cache.lookup(text)
+    if cached is not None:
+        print(f"Keyword extraction cache hit for input: {text[:100]}...")
+        yield "keywords", {"keywords": cached["keywords"], "summaries": cached["summaries"], "cached": True}
+        yield from _stream_save(cached["keywords"], _cached_embeddings(text, cached), student_id, project_name)
+    elif mode == "adk":
+        with session_pool.session(user_id) as (session_user_id, session_id):
+            yield from _agent_stages(text, session_user_id, session_id, student_id, project_name)
+    else:
+        print(f"Starting fast keywords pipeline with input: {text[:100]}...")
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            known_topics_future = pool.submit(get_known_topics, 0.8, student_id, project_name)
+            extraction_future = pool.submit(extract_keywords_chunked, text)
+            yield "known_topics", {"known_topics": known_topics_future.result()}
+            keywords, summaries, embeddings = extraction_future.result()
+        extraction_cache.store(text, keywords, summaries, embeddings, EMBEDDING_MODEL)
+        yield "keywords", {"keywords": keywords, "summaries": summaries, "cached": False}
+        yield from _stream_save(keywords, embeddings, student_id, project_name)
+
+
+def _stream_save(keywords, embeddings, student_id, project_name):
+    keywords, embeddings, existing_keywords = upsert_keywords(keywords, embeddings, student_id, project_name)
+    docs = [None] * len(keywords)
+    for index, related in iter_query_results(keywords, query_vectors=embeddings,
+                                             **related_documents_scope(student_id, project_name)):
+        docs[index] = keyword_document(keywords[index], existing_keywords.get(keywords[index], 0.0), related)
+        yield "related_documents", docs[index]
+    yield "done", {"result": docs}
+
+
+def _run_agent(text, user_id=None, student_id=None, project_name=None):
+    """
+    Runs the ADK agent pipeline for one text.
     Handles the sequential flow of the agent pipeline.
     """
+    with session_pool.session(user_id) as (session_user_id, session_id):
+        return _run_agent_in_session(text, session_user_id, session_id, student_id, project_name)
+
+
+def _run_agent_in_session(text, user_id, session_id, student_id=None, project_name=None):
+    for stage, data in _agent_stages(text, user_id, session_id, student_id, project_name):
+        if stage == "done":
+            return data["result"]
+
+
+def _agent_stages(text, user_id, session_id, student_id=None, project_name=None):
+    """
+    Runs the ADK pipeline in a session and yields the stream_agent stages
+    from the runner events. Stops once the save tool responded.
+    """
+    # The tools read the scope of this run from the session state
+    session = session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    session_service.append_event(session, Event(
+        author="user",
+        actions=EventActions(state_delta={"student_id": student_id, "project_name": project_name}),
+    ))
+
     content = types.Content(role='user', parts=[types.Part(text=text)])
     
     # Enable debug logging
     print(f"Starting agent pipeline with input: {text[:100]}...")
     
     # Get all events from the runner, including intermediate steps
-    events = runner.run(user_id=USER_ID, session_id=SESSION_ID, new_message=content)
+    events = runner.run(user_id=user_id, session_id=session_id, new_message=content)
     
     # Track intermediate responses for debugging
     all_responses = []
@@ -228,11 +484,24 @@ def call_agent(text):
         #     print(f"Processing event from agent: {event.agent_name}")
         
         print(f"Event author: {event.author}")
+        if not event.content or not event.content.parts:
+            continue
         final_response = event.content.parts[0].function_response
-        if event.author == "save_keywords_agent" and final_response is not None:
-            # session_service.delete_session(session)
-            # session = session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
-            return json.loads(final_response.response["result"])["saved_count"]["result"]
+        if event.author == "get_known_topics_agent" and final_response is not None:
+            yield "known_topics", {"known_topics": json.loads(final_response.response["result"])}
+        elif event.author == "extract_keywords_agent" and event.is_final_response():
+            try:
+                extracted = KeywordsResponse.model_validate_json(event.content.parts[0].text or "")
+            except ValueError:
+                continue
+            yield "keywords", {"keywords": extracted.keywords, "summaries": extracted.summaries, "cached": False}
+        elif event.author == "save_keywords_agent" and final_response is not None:
+            _cache_session_extraction(text, user_id, session_id)
+            docs = json.loads(final_response.response["result"])["saved_count"]["result"]
+            for doc in docs:
+                yield "related_documents", doc
+            yield "done", {"result": docs}
+            return
         # print("Final response: ", final_response)
         # all_responses.append({"type": "final", "content": final_response})
         
@@ -254,6 +523,23 @@ def call_agent(text):
             
         #     # return response_data
 
+def _cache_session_extraction(text, user_id, session_id):
+    """
+    Stores the output of extract_keywords_agent kept in the session state.
+    Embeddings are computed by the save tool and not kept: the first cache hit
+    computes them and stores them in the entry.
+    """
+    session = session_service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    extracted = session.state.get("extracted_keywords") if session else None
+    if not extracted:
+        return
+    try:
+        extracted = KeywordsResponse.model_validate(extracted)
+    except ValueError as e:
+        print(f"Not caching invalid extraction: {e}")
+        return
+    extraction_cache.store(text, extracted.keywords, extracted.summaries)
+
 # def save_response_to_file(response_data, filename=None):
 #     """
 #     Save response data to a JSON file with proper indentation.
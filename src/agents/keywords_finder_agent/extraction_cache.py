@@ -0,0 +1,69 @@
+import hashlib
+import unicodedata
+from datetime import datetime
+
+from pymongo.errors import OperationFailure
+
+KEYWORDS_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+
+def normalize_text(text: str) -> str:
+    """Texts differing only in unicode form or whitespace share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class ExtractionCache:
+    """
+    Persistent cache of keyword extraction results, keyed by the normalized
+    input text hash, the extraction model and the prompt version.
+    """
+
+    def __init__(self, collection, model: str, prompt_version: str, ttl_seconds: int = KEYWORDS_CACHE_TTL_SECONDS):
+        self.collection = collection
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self._indexes_ready = False
+
+    def key(self, text: str) -> str:
+        text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model}:{self.prompt_version}:{text_hash}"
+
+    def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        try:
+            self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        except OperationFailure as e:
+            print(f"Could not create keyword cache TTL index: {e}")
+        self._indexes_ready = True
+
+    def lookup(self, text: str):
+        """
+        Returns the cached {"keywords", "summaries", "embeddings", "embedding_model"} or None.
+        """
+        return self.collection.find_one({"_id": self.key(text)}, {"_id": 0, "created_at": 0})
+
+    def store(self, text: str, keywords: list, summaries: list, embeddings: list = None,
+              embedding_model: str = None):
+        self._ensure_indexes()
+        self.collection.replace_one(
+            {"_id": self.key(text)},
+            {
+                "model": self.model,
+                "prompt_version": self.prompt_version,
+                "keywords": keywords,
+                "summaries": summaries,
+                "embeddings": embeddings,
+                "embedding_model": embedding_model,
+                "created_at": datetime.now(),
+            },
+            upsert=True
+        )
+
+    def store_embeddings(self, text: str, embeddings: list, embedding_model: str):
+        """Adds the keyword embeddings to an entry stored without them, or with another embedding model."""
+        self.collection.update_one(
+            {"_id": self.key(text)},
+            {"$set": {"embeddings": embeddings, "embedding_model": embedding_model}},
+        )
@@ -0,0 +1,97 @@
+import re
+
+import numpy as np
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_text(text: str, chunk_chars: int, overlap_chars: int = 0) -> list:
+    """
+    Splits text into chunks of at most `chunk_chars` characters, cutting at
+    paragraph, then sentence, then word boundaries. Each chunk after the first
+    starts with the last `overlap_chars` characters of the previous one, so
+    terms spanning a cut are seen whole by at least one chunk.
+    """
+    if len(text) <= chunk_chars:
+        return [text]
+
+    pieces = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        if len(paragraph) <= chunk_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            while len(sentence) > chunk_chars:
+                cut = sentence.rfind(" ", 0, chunk_chars)
+                cut = cut if cut > 0 else chunk_chars
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:].lstrip()
+            pieces.append(sentence)
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if not piece.strip():
+            continue
+        if current and len(current) + len(piece) + 1 > chunk_chars:
+            chunks.append(current)
+            tail = current[-overlap_chars:] if overlap_chars else ""
+            # Only keep the overlap when the next piece still fits after it
+            current = tail if len(tail) + len(piece) + 1 <= chunk_chars else ""
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _normalize_keyword(keyword: str) -> str:
+    return " ".join(keyword.casefold().split())
+
+
+def merge_extractions(extractions: list, embed_fn, similarity_threshold: float, max_keywords: int = None):
+    """
+    Reduce step of the chunked extraction.
+
+    `extractions` holds one (keywords, summaries) pair per chunk, in text order.
+    Keywords are merged by exact match after case and whitespace folding, then
+    keywords whose embeddings have a cosine similarity of at least
+    `similarity_threshold` are merged into the first one. The result is ranked
+    by the number of chunks a keyword appeared in, ties broken by first
+    appearance.
+
+    Returns (keywords, summaries, embeddings).
+    """
+    # Exact dedupe: normalized keyword -> [keyword, summary, chunks it appeared in]
+    merged = {}
+    for chunk_index, (keywords, summaries) in enumerate(extractions):
+        for i, keyword in enumerate(keywords):
+            entry = merged.setdefault(_normalize_keyword(keyword),
+                                      [keyword, summaries[i] if i < len(summaries) else "", set()])
+            entry[2].add(chunk_index)
+    if not merged:
+        return [], [], []
+
+    entries = list(merged.values())
+    embeddings = np.asarray(embed_fn([entry[0] for entry in entries]), dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1.0, norms)
+
+    # Near-duplicate dedupe: every keyword joins the first kept keyword it is similar enough to
+    kept = []
+    for i, entry in enumerate(entries):
+        if kept:
+            similarities = unit[kept] @ unit[i]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= similarity_threshold:
+                entries[kept[best]][2] |= entry[2]
+                continue
+        kept.append(i)
+
+    ranked = sorted(kept, key=lambda i: (-len(entries[i][2]), i))
+    if max_keywords:
+        ranked = ranked[:max_keywords]
+    return (
+        [entries[i][0] for i in ranked],
+        [entries[i][1] for i in ranked],
+        [embeddings[i].tolist() for i in ranked],
+    )
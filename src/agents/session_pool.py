@@ -0,0 +1,101 @@
+import os
+import sys
+import uuid
+import threading
+from contextlib import contextmanager
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cache import TTLCache
+
+ADK_MAX_SESSIONS = int(os.getenv("ADK_MAX_SESSIONS", 256))
+ADK_SESSION_TTL = float(os.getenv("ADK_SESSION_TTL", 1800))
+ADK_MAX_SESSION_EVENTS = int(os.getenv("ADK_MAX_SESSION_EVENTS", 60))
+
+# Owner of the single-use sessions of requests without a user
+ANONYMOUS_USER_ID = "anonymous"
+
+
+class SessionPool:
+    """
+    ADK sessions per request or per user, instead of one global session.
+
+    Requests without a user get a fresh session that is deleted afterwards.
+    Users keep one session between requests; it is evicted when idle for
+    `ttl_seconds`, when more than `max_sessions` users are active (LRU), or
+    once its history grows past `max_events`, so prompts stay small and the
+    session store never grows without bound.
+    """
+
+    def __init__(self, session_service, app_name: str, max_sessions: int = ADK_MAX_SESSIONS,
+                 ttl_seconds: float = ADK_SESSION_TTL, max_events: int = ADK_MAX_SESSION_EVENTS):
+        self.session_service = session_service
+        self.app_name = app_name
+        self.max_events = max_events
+        # user_id -> (session_id, lock)
+        self._user_sessions = TTLCache(max_size=max_sessions, ttl_seconds=ttl_seconds,
+                                       on_evict=self._evicted)
+        self._lock = threading.Lock()
+
+    def _create(self, user_id: str) -> str:
+        session_id = uuid.uuid4().hex
+        self.session_service.create_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+        return session_id
+
+    def _delete(self, user_id: str, session_id: str):
+        try:
+            self.session_service.delete_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+        except Exception as e:
+            print(f"Could not delete session {session_id} of user {user_id}: {e}")
+
+    def _evicted(self, user_id: str, entry):
+        session_id, session_lock = entry
+        # A session in use is registered again or deleted when its run finishes
+        if not session_lock.locked():
+            self._delete(user_id, session_id)
+
+    def _history_length(self, user_id: str, session_id: str) -> int:
+        session = self.session_service.get_session(app_name=self.app_name, user_id=user_id, session_id=session_id)
+        return len(session.events) if session else 0
+
+    @contextmanager
+    def session(self, user_id: str = None):
+        """
+        Yields (user_id, session_id) for one run. A user's session is used by
+        one request at a time; concurrent requests of the same user get a
+        fresh single-use session.
+        """
+        entry = None
+        if user_id is not None:
+            with self._lock:
+                entry = self._user_sessions.get(user_id)
+                if entry is None:
+                    entry = (self._create(user_id), threading.Lock())
+                    self._user_sessions.set(user_id, entry)
+            if not entry[1].acquire(blocking=False):
+                entry = None
+
+        if entry is None:
+            run_user_id = user_id or ANONYMOUS_USER_ID
+            session_id = self._create(run_user_id)
+            try:
+                yield run_user_id, session_id
+            finally:
+                self._delete(run_user_id, session_id)
+            return
+
+        session_id, session_lock = entry
+        try:
+            yield user_id, session_id
+        finally:
+            with self._lock:
+                if self._history_length(user_id, session_id) > self.max_events:
+                    # Start the next request of this user with an empty history
+                    self._user_sessions.pop(user_id)
+                    self._delete(user_id, session_id)
+                else:
+                    # Refresh the idle timeout
+                    self._user_sessions.set(user_id, entry)
+            session_lock.release()
+
+    def __len__(self):
+        return len(self._user_sessions)
@@ -3,11 +3,27 @@ from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.adk.tools import google_search
 from google.genai import types
+import os
+import sys
 import json
+import hashlib
 from google.adk.agents import Agent, SequentialAgent
 from pydantic import BaseModel, Field
 
-from .planner import generate_study_graph, save_study_graph
+from .planner import (generate_study_graph, save_study_graph, segments_fingerprint, get_fingerprinted_graph,
+                      get_planning_graph, project_files, summarize_study_graph, merge_study_graph,
+                      normalize_study_graph)
+from ..session_pool import SessionPool
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from config import STUDY_GRAPH_CONTEXT_TOKENS, STUDY_GRAPH_CONTEXT_STRATEGY
+from embeddings import EMBEDDING_MODEL
+from db.client import MongoDBClient
+from documents.context_builder import build_context
+from llm import generate_structured
+
+# New topics whose names are at least this similar to an existing topic are merged into it
+STUDY_GRAPH_MERGE_SIMILARITY = float(os.getenv("STUDY_GRAPH_MERGE_SIMILARITY", 0.9))
 
 
 class StudyGraph(BaseModel):
@@ -80,9 +96,16 @@ save_graph_agent = Agent(
 )
 
 
+extend_graph_instruction = (
+    "You are an expert curriculum designer extending an existing study graph with a new document. "
+    "You receive the existing graph (node ids and prerequisite edges) and content snippets of the new document. "
+    "Return only the topics the new document adds as nodes, the prerequisite edges involving them "
+    "(they may connect to existing node ids), and the study sequence of the new topics. "
+    "Reuse an existing node id when a topic is already in the graph."
+)
+
+
 APP_NAME="graph_sequential_agent"
-USER_ID="user1234"
-SESSION_ID="1234"
 
 # Create sequential agent that combines both agents
 root_agent = SequentialAgent(
@@ -92,26 +115,91 @@ root_agent = SequentialAgent(
 )
 
 
-# Session and Runner
+# Session and Runner: every generation runs in its own single-use session, see SessionPool
 session_service = InMemorySessionService()
-session = session_service.create_session(app_name=APP_NAME, user_id=USER_ID, session_id=SESSION_ID)
+session_pool = SessionPool(session_service, APP_NAME)
 runner = Runner(agent=root_agent, app_name=APP_NAME, session_service=session_service)
 
 
+# Changes whenever the prompt, the output schema, the models or the context settings change
+STUDY_GRAPH_VERSION = hashlib.sha256(json.dumps([
+    extract_graph_agent_prompt,
+    StudyGraph.model_json_schema(),
+    get_context_agent.model,
+    extract_graph_agent.model,
+    EMBEDDING_MODEL,
+    STUDY_GRAPH_CONTEXT_STRATEGY,
+    STUDY_GRAPH_CONTEXT_TOKENS,
+], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def extend_study_graph(student_id, project_name, fingerprint):
+    """
+    Incremental generation: when files were only added since the stored graph
+    was generated, only their context and a compact summary of the stored
+    graph are sent to the LLM, and the proposed additions are merged into the
+    stored graph. Returns the merged graph, or None when a full generation is
+    needed (no stored graph, files removed or changed).
+    """
+    graph, graph_files = get_planning_graph(student_id, project_name)
+    if not graph or graph_files is None:
+        return None
+    files = project_files(student_id, project_name)
+    new_files = [f for f in files if f not in graph_files]
+    if not new_files or set(graph_files) - set(files):
+        return None
+
+    print(f"Extending study graph of student {student_id} and project '{project_name}' with {new_files}")
+    segments_col = MongoDBClient().select_collection('documents_segments')
+    context = build_context(segments_col, student_id, project_name, STUDY_GRAPH_CONTEXT_TOKENS, file_names=new_files)
+    if not context:
+        return None
+    prompt = f"Existing graph:\n{summarize_study_graph(graph)}\n\nNew document content snippets:\n{context}"
+    additions = generate_structured(prompt, StudyGraph, model=extract_graph_agent.model,
+                                    system_instruction=extend_graph_instruction)
+
+    merged = normalize_study_graph(merge_study_graph(graph, additions.model_dump(), STUDY_GRAPH_MERGE_SIMILARITY))
+    save_study_graph(student_id, project_name, merged, fingerprint, files)
+    return merged
+
+
 # Agent Interaction
-def call_agent(query):
+def call_agent(query, force=False, incremental=True, fingerprint=None):
     """
     Helper function to call the agent with a query.
+    Returns the stored graph without calling the LLM when the project's
+    segments and the generation version are unchanged since it was saved;
+    force=True regenerates it anyway. When files were only added, the stored
+    graph is extended from the new files (see extend_study_graph) unless
+    incremental is False. Callers that already computed the project's
+    segments fingerprint can pass it to avoid scanning the segments again.
     """
-    content = types.Content(role='user', parts=[types.Part(text=query)])
-    events = runner.run(user_id=USER_ID, session_id=SESSION_ID, new_message=content)
-
     # load query text into dict
     query_dict = json.loads(query)
     # get student_id and project_name
     student_id = query_dict.get('student_id')
     project_name = query_dict.get('project_name')
 
+    fingerprint = fingerprint or segments_fingerprint(student_id, project_name, STUDY_GRAPH_VERSION)
+    if not force:
+        stored_graph = get_fingerprinted_graph(student_id, project_name, fingerprint)
+        if stored_graph:
+            print(f"Study graph of student {student_id} and project '{project_name}' is up to date.")
+            return stored_graph
+        if incremental:
+            extended_graph = extend_study_graph(student_id, project_name, fingerprint)
+            if extended_graph:
+                return extended_graph
+
+    files = project_files(student_id, project_name)
+    with session_pool.session() as (user_id, session_id):
+        return _run_agent(query, user_id, session_id, student_id, project_name, fingerprint, files)
+
+
+def _run_agent(query, user_id, session_id, student_id, project_name, fingerprint=None, files=None):
+    content = types.Content(role='user', parts=[types.Part(text=query)])
+    events = runner.run(user_id=user_id, session_id=session_id, new_message=content)
+
     for event in events:
         if event.is_final_response():
             final_response = event.content.parts[0].text
@@ -121,10 +209,12 @@ def call_agent(query):
                 json_response = json.loads(final_response)
                 # if it has nodes_id, nodes, edges, sequence
                 if all(key in json_response for key in ['nodes_id', 'nodes', 'edges', 'sequence']):
-                    # save the graph to the database
-                    save_graph_response = save_study_graph_to_db(student_id, project_name, json.dumps(json_response))
+                    # check edges and sequence locally, then save the graph to the database
+                    json_response = normalize_study_graph(json_response)
+                    save_graph_response = save_study_graph(student_id, project_name, json_response, fingerprint, files)
                     if save_graph_response:
                         print("Graph saved successfully to the database.")
+                        return json_response
                     else:
                         print("Failed to save graph to the database.")
 
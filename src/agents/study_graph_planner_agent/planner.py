@@ -2,14 +2,22 @@ import os
 import sys
 from google import genai
 import json
+import hashlib
 from google.genai.types import HttpOptions, ModelContent, Part, UserContent
 
+import numpy as np
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
 from pydantic import BaseModel, Field
 
 # add the parent directory to the system path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 from db.client import MongoDBClient
-from config import GOOGLE_API_KEY
+from config import GOOGLE_API_KEY, STUDY_GRAPH_CONTEXT_TOKENS, STUDY_GRAPH_CONTEXT_STRATEGY
+from documents.context_builder import build_context
+from documents.representatives import build_representative_context
+from embeddings import embed_texts
+from study_graph import DependencyGraph, break_cycles
 
 
 class StudyGraph(BaseModel):
@@ -29,19 +37,16 @@ def generate_study_graph(std_id: int, project_name: str) -> str:
     """
     db = MongoDBClient()
     segments_col = db.select_collection('documents_segments')
-    segments = list(segments_col.find({
-        "std_id": std_id,
-        "project_name": project_name
-    }))
-    if not segments:
-        return "No content found for this student/project. Please ingest PDFs first."
 
-    # Summarize segment texts into a single context
-    context_snippets = []
-    for seg in segments:
-        snippet = seg['text'][:200].replace("", " ")
-        context_snippets.append(f"- {seg['file_name']} (p{seg['page_number']}): {snippet}")
-    context = "".join(context_snippets)
+    # Summarize segment texts into a single context bounded by the token budget.
+    # Projects without segments embedded with the current model fall back to the page split.
+    context = ""
+    if STUDY_GRAPH_CONTEXT_STRATEGY == "clusters":
+        context = build_representative_context(segments_col, std_id, project_name, STUDY_GRAPH_CONTEXT_TOKENS)
+    if not context:
+        context = build_context(segments_col, std_id, project_name, STUDY_GRAPH_CONTEXT_TOKENS)
+    if not context:
+        return "No content found for this student/project. Please ingest PDFs first."
 
     # Prompt the LLM to generate a graph plan
     # client = genai.Client(api_key=GOOGLE_API_KEY)
@@ -55,49 +60,328 @@ def generate_study_graph(std_id: int, project_name: str) -> str:
     return context
 
 
-def save_study_graph(std_id: int, project_name: str, graph: dict):
+def segments_fingerprint(std_id: int, project_name: str, version: str) -> str:
     """
-    Saves the generated study graph to the database.
+    Fingerprint of the segment set of a student project and of the generation
+    version (prompt, models, context settings). It changes whenever a segment
+    is added, replaced or removed, or when the generation itself changes.
+    """
+    db = MongoDBClient()
+    segments_col = db.select_collection('documents_segments')
+    digest = hashlib.sha256(version.encode("utf-8"))
+    # Only the ids are read, in index order
+    for seg in segments_col.find({"std_id": std_id, "project_name": project_name}, {"_id": 1}).sort("_id", 1):
+        digest.update(str(seg["_id"]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_fingerprinted_graph(std_id: int, project_name: str, fingerprint: str):
+    """
+    Returns the stored planning_graph when it was generated from the content
+    and version `fingerprint` describes, otherwise None.
     """
     db = MongoDBClient()
     graphs_col = db.select_collection('test1')
-    graph_data = {
-        "student_id": std_id,
-        "project_name": project_name,
-        "planning_graph": graph
-    }
+    doc = graphs_col.find_one(
+        {"student_id": std_id, "project_name": project_name, "planning_graph_fingerprint": fingerprint},
+        {"_id": 0, "planning_graph": 1}
+    )
+    return doc.get("planning_graph") if doc else None
 
-    # get document for the student and project
-    student_project_doc = graphs_col.find_one({
-        "student_id": std_id,
-        "project_name": project_name
-    })
 
-    # combine the graph data with the existing document
-    if student_project_doc:
-        graph_data = {**student_project_doc, **graph_data}
+def project_files(std_id: int, project_name: str) -> list:
+    """Sorted names of the files with segments in a student project."""
+    db = MongoDBClient()
+    segments_col = db.select_collection('documents_segments')
+    return sorted(segments_col.distinct("file_name", {"std_id": std_id, "project_name": project_name}))
 
-    print("Graph data to be saved:", graph_data)
 
-    # Check if a graph already exists for this student and project by checking planning_graph field
-    existing_graph = graphs_col.find_one({
-        "student_id": std_id,
-        "project_name": project_name,
-        "planning_graph": {"$exists": True}
-    })
+def get_planning_graph(std_id: int, project_name: str):
+    """
+    Returns the stored planning_graph and the files it was generated from
+    (None for graphs saved before the files were recorded).
+    """
+    db = MongoDBClient()
+    graphs_col = db.select_collection('test1')
+    doc = graphs_col.find_one(
+        {"student_id": std_id, "project_name": project_name},
+        {"_id": 0, "planning_graph": 1, "planning_graph_files": 1}
+    )
+    if not doc:
+        return None, None
+    return doc.get("planning_graph"), doc.get("planning_graph_files")
+
+
+def summarize_study_graph(graph: dict) -> str:
+    """Compact text form of a graph for prompts: node ids, then one 'source -> target' line per edge."""
+    lines = ["Node ids: " + ", ".join(graph.get("nodes_id", []))]
+    lines.extend(f"{source} -> {target}" for source, target in graph.get("edges", []))
+    return "\n".join(lines)
+
+
+def _node_id(node_id: str) -> str:
+    return " ".join(str(node_id).lower().split())
+
+
+def merge_study_graph(graph: dict, additions: dict, similarity_threshold: float) -> dict:
+    """
+    Merges the nodes, edges and sequence of `additions` into `graph`.
 
-    if existing_graph:
-        # update the existing graph of the student and project
-        graphs_col.update_one(
-            {"student_id": std_id, "project_name": project_name},
-            {"$set": graph_data}
+    A new node is the same as an existing one when their ids match
+    (case-insensitively), or when the embeddings of their names have a cosine
+    similarity of at least `similarity_threshold`. Edges are remapped onto the
+    merged ids; edges with an unknown end and self loops are dropped. New nodes
+    are appended to the sequence in the order the additions propose.
+    """
+    nodes_id = list(graph.get("nodes_id", []))
+    nodes = list(graph.get("nodes", []))
+    known = {_node_id(node_id): node_id for node_id in nodes_id}
+
+    # New nodes, deduplicated by id among themselves
+    candidates = {}
+    for node_id, name in zip(additions.get("nodes_id", []), additions.get("nodes", [])):
+        if _node_id(node_id) not in known:
+            candidates.setdefault(_node_id(node_id), (node_id, name))
+
+    id_map = {key: node_id for key, node_id in known.items()}
+    if candidates:
+        candidate_items = list(candidates.items())
+        vectors = np.asarray(embed_texts(nodes + [name for _, (_, name) in candidate_items]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        kept_vectors, kept_ids = list(vectors[:len(nodes)]), list(nodes_id)
+        for (key, (node_id, name)), vector in zip(candidate_items, vectors[len(nodes):]):
+            if kept_vectors:
+                similarities = np.asarray(kept_vectors) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= similarity_threshold:
+                    id_map[key] = kept_ids[best]
+                    continue
+            id_map[key] = node_id
+            nodes_id.append(node_id)
+            nodes.append(name)
+            kept_vectors.append(vector)
+            kept_ids.append(node_id)
+
+    edges, seen = [], set()
+    for source, target in list(graph.get("edges", [])) + list(additions.get("edges", [])):
+        source, target = id_map.get(_node_id(source)), id_map.get(_node_id(target))
+        if source is None or target is None or source == target or (source, target) in seen:
+            continue
+        seen.add((source, target))
+        edges.append([source, target])
+
+    sequence = list(graph.get("sequence", []))
+    in_sequence = set(sequence)
+    for node_id in list(additions.get("sequence", [])) + nodes_id:
+        node_id = id_map.get(_node_id(node_id))
+        if node_id is not None and node_id not in in_sequence:
+            sequence.append(node_id)
+            in_sequence.add(node_id)
+
+    return {**graph, "nodes_id": nodes_id, "nodes": nodes, "edges": edges, "sequence": sequence}
+
+
+def normalize_study_graph(graph: dict) -> dict:
+    """
+    Checks the LLM's edges and sequence locally instead of trusting them:
+    edges to unknown nodes are dropped, cycles are broken by dropping the
+    edges that point backwards in the proposed sequence, and the sequence is
+    replaced by a topological order (following the proposed one where the
+    edges allow) when it misses nodes or violates a prerequisite.
+    """
+    nodes_id = graph.get("nodes_id", [])
+    proposed = graph.get("sequence", [])
+    priority = {}
+    for position, node_id in enumerate(proposed):
+        priority.setdefault(node_id, position)
+
+    dependency_graph = DependencyGraph(nodes_id, graph.get("edges", []))
+    if dependency_graph.unknown_edges:
+        print(f"Dropping edges to unknown nodes: {dependency_graph.unknown_edges}")
+    cycle = dependency_graph.find_cycle()
+    if cycle:
+        print(f"Breaking prerequisite cycle: {' -> '.join(cycle)}")
+        dependency_graph = DependencyGraph(nodes_id, break_cycles(dependency_graph, priority))
+
+    kept = {(source, target) for source, target in dependency_graph.edges()}
+    edges = []
+    for edge in graph.get("edges", []):
+        if tuple(edge) in kept:
+            kept.discard(tuple(edge))
+            edges.append(list(edge))
+
+    sequence = proposed
+    if not dependency_graph.is_valid_order(proposed):
+        print("Recomputing the study sequence from the prerequisite edges")
+        sequence = dependency_graph.topological_order(priority)
+    return {**graph, "edges": edges, "sequence": sequence}
+
+
+_graph_indexes_ready = False
+
+
+def ensure_study_graph_indexes(db):
+    """
+    Creates, once per process, the unique (student_id, project_name) index the
+    graph upsert relies on and the indexes of the normalized node and edge
+    collections: nodes are looked up by id (also by $graphLookup) and listed
+    in sequence order, edges are looked up from either end.
+
+    The student index is partial: documents ingested before records were
+    keyed by student_id have none, and would all collide on null otherwise.
+    """
+    global _graph_indexes_ready
+    if _graph_indexes_ready:
+        return
+    graphs_col = db.select_collection('test1')
+    try:
+        # An earlier non-partial version of the index is replaced
+        existing = graphs_col.index_information().get("student_id_1_project_name_1", {})
+        if existing and "partialFilterExpression" not in existing:
+            graphs_col.drop_index("student_id_1_project_name_1")
+        graphs_col.create_index(
+            [("student_id", 1), ("project_name", 1)], unique=True,
+            partialFilterExpression={"student_id": {"$exists": True}}
+        )
+    except OperationFailure as e:
+        # Duplicate student/project documents must be merged before the index can be built
+        print(f"Could not create unique student/project index: {e}")
+    nodes_col = db.select_collection('study_graph_nodes')
+    nodes_col.create_index([("student_id", 1), ("project_name", 1), ("node_id", 1)], unique=True)
+    nodes_col.create_index([("student_id", 1), ("project_name", 1), ("position", 1)])
+    edges_col = db.select_collection('study_graph_edges')
+    edges_col.create_index([("student_id", 1), ("project_name", 1), ("source", 1), ("target", 1)], unique=True)
+    edges_col.create_index([("student_id", 1), ("project_name", 1), ("target", 1)])
+    _graph_indexes_ready = True
+
+
+def _replace_newer(collection, operations):
+    """
+    Runs version-guarded upserts. An upsert whose filter misses because a
+    newer version is already stored hits the unique index instead; those
+    duplicate key errors mean "keep the newer document" and are ignored.
+    """
+    if not operations:
+        return
+    try:
+        collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+def save_graph_collections(db, std_id: int, project_name: str, graph: dict, version: int):
+    """
+    Writes a study graph into the normalized `study_graph_nodes` and
+    `study_graph_edges` collections, one document per node and per edge keyed
+    by (student_id, project_name, node_id) and (..., source, target). Node
+    documents carry their sequence position and direct prerequisites,
+    dependents and neighbours, so subgraphs can be read without loading the
+    whole graph. Documents are tagged with the graph version: an older save
+    never overwrites a newer one, and once written, every document older than
+    the latest saved version is removed.
+    """
+    scope = {"student_id": std_id, "project_name": project_name}
+    stale = {**scope, "planning_graph_version": {"$lt": version}}
+    nodes_id = graph.get("nodes_id", [])
+    position = {node_id: i for i, node_id in enumerate(graph.get("sequence", []))}
+    prerequisites = {node_id: [] for node_id in nodes_id}
+    dependents = {node_id: [] for node_id in nodes_id}
+    edges = []
+    for source, target in graph.get("edges", []):
+        if source in dependents and target in prerequisites:
+            dependents[source].append(target)
+            prerequisites[target].append(source)
+            edges.append((source, target))
+
+    nodes_col = db.select_collection('study_graph_nodes')
+    _replace_newer(nodes_col, [
+        ReplaceOne(
+            {**stale, "node_id": node_id},
+            {
+                **scope,
+                "node_id": node_id,
+                "name": name,
+                "position": position.get(node_id, len(position) + i),
+                "prerequisites": prerequisites[node_id],
+                "dependents": dependents[node_id],
+                "neighbors": list(dict.fromkeys(prerequisites[node_id] + dependents[node_id])),
+                "planning_graph_version": version,
+            },
+            upsert=True
         )
-    else:
-        # insert new planning_graph key in the document for the student and project (append of new key in the document)
-        graphs_col.insert_one(graph_data)
+        for i, (node_id, name) in enumerate(zip(nodes_id, graph.get("nodes", [])))
+    ])
+    edges_col = db.select_collection('study_graph_edges')
+    _replace_newer(edges_col, [
+        ReplaceOne(
+            {**stale, "source": source, "target": target},
+            {**scope, "source": source, "target": target, "planning_graph_version": version},
+            upsert=True
+        )
+        for source, target in edges
+    ])
+
+    # Sweep against the latest version, so nodes only an older concurrent save had are dropped too
+    latest = db.select_collection('test1').find_one(scope, {"_id": 0, "planning_graph_version": 1})
+    latest = max(version, (latest or {}).get("planning_graph_version") or 0)
+    stale = {**scope, "planning_graph_version": {"$lt": latest}}
+    nodes_col.delete_many(stale)
+    edges_col.delete_many(stale)
+
+
+def backfill_graph_collections() -> int:
+    """
+    Writes the node and edge collections of every stored graph, so graphs
+    saved before they existed are served by the subgraph endpoints. Run it
+    once after deploying them (`python src/study_graph_batch.py --backfill`);
+    rerunning is safe, nodes and edges already at a graph's version are kept.
+    Returns the number of graphs written.
+    """
+    db = MongoDBClient()
+    ensure_study_graph_indexes(db)
+    graphs_col = db.select_collection('test1')
+    count = 0
+    for doc in graphs_col.find({"student_id": {"$exists": True}, "planning_graph": {"$type": "object"}},
+                               {"student_id": 1, "project_name": 1, "planning_graph": 1, "planning_graph_version": 1}):
+        save_graph_collections(db, doc["student_id"], doc["project_name"], doc["planning_graph"],
+                               doc.get("planning_graph_version") or 0)
+        count += 1
+    print(f"Node and edge collections written for {count} study graphs")
+    return count
+
+
+def save_study_graph(std_id: int, project_name: str, graph: dict, fingerprint: str = None, files: list = None) -> int:
+    """
+    Saves the generated study graph to the database, tagged with the
+    fingerprint of the content it was generated from and its files.
+    One atomic upsert: creates the student/project document if needed and
+    bumps its graph version, then the normalized node and edge collections
+    are written for that version. Returns the new planning_graph_version.
+    """
+    db = MongoDBClient()
+    graphs_col = db.select_collection('test1')
+    ensure_study_graph_indexes(db)
+    graph_data = {
+        "planning_graph": graph,
+        "planning_graph_fingerprint": fingerprint,
+        "planning_graph_files": files,
+    }
+
+    print("Graph data to be saved:", graph_data)
+
+    saved = graphs_col.find_one_and_update(
+        {"student_id": std_id, "project_name": project_name},
+        {"$set": graph_data, "$inc": {"planning_graph_version": 1}},
+        projection={"_id": 0, "planning_graph_version": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    save_graph_collections(db, std_id, project_name, graph, saved["planning_graph_version"])
 
     print(f"Study graph saved for student {std_id} and project '{project_name}'.")
-    return True
+    return saved["planning_graph_version"]
 
 
 def get_study_graph(std_id: int, project_name: str) -> StudyGraph:
@@ -2,6 +2,8 @@ import os
 import sys
 
 from google.adk.agents import Agent
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 from db.client import MongoDBClient
@@ -19,132 +21,239 @@ def get_known_topics(student_id: int, project_name: str):
         return student.get('known_topics', [])
     return []
 
-def get_keywords(known_topics: list):
+_topic_index_ready = False
+
+
+def ensure_topic_index(keywords_col):
+    """
+    Creates the (student_id, project_name, keyword, knowledge_level) index the
+    topic aggregations match and sort on, once per process.
+    """
+    global _topic_index_ready
+    if _topic_index_ready:
+        return
+    try:
+        # Replaced by the student-scoped index
+        if "keyword_1_knowledge_level_-1" in keywords_col.index_information():
+            keywords_col.drop_index("keyword_1_knowledge_level_-1")
+        keywords_col.create_index([("student_id", 1), ("project_name", 1), ("keyword", 1), ("knowledge_level", -1)])
+    except OperationFailure as e:
+        print(f"Could not create keyword knowledge index: {e}")
+    _topic_index_ready = True
+
+
+def top_levels_stages(scoped) -> list:
+    """
+    Stages grouping keyword documents into the 5 highest knowledge levels per
+    keyword and their average. `scoped` is the expression true for the
+    student's own keyword documents: a keyword uses those when the student has
+    any, and the unscoped ones (saved without a student) otherwise. Keyword
+    upserts are unique per student, project and keyword, so only unscoped
+    keywords can contribute several levels.
+    """
+    return [
+        {'$set': {'scoped': scoped}},
+        {'$sort': {'keyword': 1, 'scoped': -1, 'knowledge_level': -1}},
+        {'$group': {
+            '_id': {'keyword': '$keyword', 'scoped': '$scoped'},
+            # levels of 0 or less (or missing) count as 0
+            'levels': {'$firstN': {'input': {'$max': [{'$ifNull': ['$knowledge_level', 0]}, 0]}, 'n': 5}},
+        }},
+        {'$sort': {'_id.keyword': 1, '_id.scoped': -1}},
+        {'$group': {'_id': '$_id.keyword', 'levels': {'$first': '$levels'}}},
+        {'$project': {'levels': 1, 'average': {'$avg': '$levels'}}},
+    ]
+
+
+def get_keywords(known_topics: list, student_id: int = None, project_name: str = None):
     """
     Get keywords from the database for known topics for a given student and project
+
+    One aggregation for all topics: the 5 keyword documents with the highest
+    knowledge level per topic, and their average knowledge level, which
+    replaces the level of the topic's own entry. A topic uses the keywords of
+    the student and project when there are any, and the unscoped keywords
+    (saved without a student, or before keywords were scoped) otherwise.
     """
     client = MongoDBClient()
     keywords_col = client.select_collection('keywords')
+    ensure_topic_index(keywords_col)
+
+    topics = list(dict.fromkeys(topic.lower() for topic in known_topics))
+    top_keywords = {
+        row['_id']: row for row in keywords_col.aggregate([
+            # equality on None also matches keywords without a student_id field
+            {'$match': {'keyword': {'$in': topics}, '$or': [
+                {'student_id': student_id, 'project_name': project_name},
+                {'student_id': None},
+            ]}},
+            *top_levels_stages({'$and': [
+                {'$eq': ['$student_id', {'$literal': student_id}]},
+                {'$eq': ['$project_name', {'$literal': project_name}]},
+            ]}),
+        ])
+    }
 
     known_keywords_knowledge = []
     for topic in known_topics:
-        keywords = keywords_col.find({'keyword': topic.lower()})
-        # sort keywords by knowledge level
-        keywords = sorted(keywords, key=lambda x: x.get('knowledge_level', 0), reverse=True)
-
-        # get top 5 keywords
-        keywords = keywords[:5]
-
-        # get knowledge level for each keyword and calculate average knowledge level
-        if keywords:
-            # get knowledge level for each keyword
-            keyword_scores = []
-
-            for keyword in keywords:
-                knowledge_level = keyword.get('knowledge_level', 0)
-                if knowledge_level > 0:
-                    known_keywords_knowledge.append({
-                        'keyword': keyword['keyword'],
-                        'knowledge_level': knowledge_level
-                    })
-                    # add score to the list
-                    keyword_scores.append(knowledge_level)
-                else:
-                    # if knowledge level is 0, add to the list with a score of 0
-                    known_keywords_knowledge.append({
-                        'keyword': keyword['keyword'],
-                        'knowledge_level': 0
-                    })
-                    keyword_scores.append(0)
-            # calculate average knowledge level for the topic
-            avg_knowledge_level = sum(keyword_scores) / len(keyword_scores)
-            # update the knowledge level for the topic
-
-            for keyword in known_keywords_knowledge:
-                if keyword['keyword'] == topic:
-                    keyword['knowledge_level'] = avg_knowledge_level
-                    break
+        row = top_keywords.get(topic.lower())
+        if not row:
+            continue
+        entries = [{'keyword': row['_id'], 'knowledge_level': level} for level in row['levels']]
+        # the topic's own entry gets the average knowledge level of its top keywords
+        if row['_id'] == topic:
+            entries[0]['knowledge_level'] = row['average']
+        known_keywords_knowledge.extend(entries)
 
     # sort by knowledge level
     known_keywords_knowledge.sort(key=lambda x: x['knowledge_level'], reverse=True)
 
     return known_keywords_knowledge
 
-def update_student_knowledge_base(student_id: int, project_name: str):
+def knowledge_base_pipeline(match: dict) -> list:
+    """
+    Aggregation over the student documents matching `match` that computes
+    their knowledge base server-side with the same rules as get_keywords:
+    each student's own keywords, or the unscoped ones for topics the student
+    has no keyword of, the 5 best keyword documents per known
+    topic, the topic's own entry scored with their average, then a status
+    per entry. Outputs one
+    {_id, student_knowledge_base} document per student with known keywords,
+    entries sorted by score.
+    """
+    return [
+        {'$match': match},
+        {'$project': {
+            'student_id': 1,
+            'project_name': 1,
+            'known_topics': {'$ifNull': ['$known_topics', []]},
+            'topics': {'$map': {'input': {'$ifNull': ['$known_topics', []]}, 'in': {'$toLower': '$$this'}}},
+        }},
+        # the known topics' keywords of the student, or unscoped ones, top 5 levels per topic
+        {'$lookup': {
+            'from': 'keywords',
+            # student documents without scope fields match the keywords saved without a student
+            'let': {
+                'student_id': {'$ifNull': ['$student_id', None]},
+                'project_name': {'$ifNull': ['$project_name', None]},
+                'topics': '$topics',
+            },
+            'pipeline': [
+                {'$match': {'$expr': {'$and': [
+                    {'$in': ['$keyword', '$$topics']},
+                    {'$or': [
+                        {'$and': [
+                            {'$eq': ['$student_id', '$$student_id']},
+                            {'$eq': ['$project_name', '$$project_name']},
+                        ]},
+                        {'$eq': [{'$ifNull': ['$student_id', None]}, None]},
+                    ]},
+                ]}}},
+                *top_levels_stages({'$and': [
+                    {'$eq': ['$student_id', '$$student_id']},
+                    {'$eq': ['$project_name', '$$project_name']},
+                ]}),
+            ],
+            'as': 'keywords',
+        }},
+        {'$unwind': '$keywords'},
+        {'$project': {
+            '_id': {'student': '$_id', 'keyword': '$keywords._id'},
+            'known_topics': 1,
+            'levels': '$keywords.levels',
+            'average': '$keywords.average',
+            'topic_position': {'$indexOfArray': ['$topics', '$keywords._id']},
+        }},
+        {'$unwind': {'path': '$levels', 'includeArrayIndex': 'rank'}},
+        # the topic's own entry gets the average knowledge level of its top keywords
+        {'$set': {'score': {'$cond': [
+            {'$and': [{'$eq': ['$rank', 0]}, {'$in': ['$_id.keyword', '$known_topics']}]},
+            '$average',
+            '$levels',
+        ]}}},
+        {'$sort': {'_id.student': 1, 'score': -1, 'topic_position': 1, 'rank': 1}},
+        {'$group': {
+            '_id': '$_id.student',
+            'student_knowledge_base': {'$push': {
+                'topic': '$_id.keyword',
+                'score': '$score',
+                'status': {'$switch': {
+                    'branches': [
+                        {'case': {'$gte': ['$score', 0.9]}, 'then': 'Completed'},
+                        {'case': {'$gte': ['$score', 0.7]}, 'then': 'In Progress'},
+                        {'case': {'$gt': ['$score', 0]}, 'then': 'Need Improvement'},
+                    ],
+                    'default': 'Not Completed',
+                }},
+            }},
+        }},
+    ]
+
+
+def update_student_knowledge_base(student_id: int, project_name: str, client: MongoDBClient = None):
     """
     Update the student knowledge base in the database by checking known topics and keywords semantic similarity.
+
+    The knowledge base is computed by one aggregation and written by one
+    find_one_and_update, which also returns it. $merge outputs no documents,
+    so writing through it here would need a third round trip to return the
+    knowledge base; only the batch refresh writes with $merge. Returns the
+    new knowledge base, or False when the student has no known keywords.
     """
-    # 1. Get known topics from the database
-    known_topics = get_known_topics(student_id, project_name)
-    print("Known topics:", known_topics)
-
-    # 2. Get keywords from the database
-    known_keywords_knowledge = get_keywords(known_topics)
-    print("Known keywords and knowledge levels:", known_keywords_knowledge)
-
-    if known_keywords_knowledge:
-        # Update the planning graph in the database
-        client = MongoDBClient()
-        student_col = client.select_collection('test1')
-        student_data = student_col.find_one({'student_id': student_id, 'project_name': project_name})
-
-        if student_data:
-            student_data['student_knowledge_base'] = []
-            for keyword in known_keywords_knowledge:
-                status = "Not Completed"
-                if keyword['knowledge_level'] >= 0.9:
-                    status = "Completed"
-                elif 0.7 <= keyword['knowledge_level'] < 0.9:
-                    status = "In Progress"
-                elif 0 < keyword['knowledge_level'] < 0.7:
-                    status = "Need Improvement"
-
-                student_data['student_knowledge_base'].append({
-                    'topic': keyword['keyword'],
-                    'score': keyword['knowledge_level'],
-                    'status': status
-                })
-
-            # Update the student knowledge base in the database
-            print("Updating student knowledge base in the database...:", student_data['student_knowledge_base'])
-            student_col.update_one(
-                {'student_id': student_id, 'project_name': project_name},
-                {'$set': {'student_knowledge_base': student_data['student_knowledge_base']}}
-            )
-        else:
-            print("Student knowledge base does not exist")
-            return False
-    else:
+    client = client or MongoDBClient()
+    student_col = client.select_collection('test1')
+    ensure_topic_index(client.select_collection('keywords'))
+
+    computed = next(student_col.aggregate(
+        knowledge_base_pipeline({'student_id': student_id, 'project_name': project_name})
+    ), None)
+    if not computed:
+        print("Student knowledge base does not exist")
+        return False
+
+    # Update the student knowledge base in the database
+    print("Updating student knowledge base in the database...:", computed['student_knowledge_base'])
+    student_data = student_col.find_one_and_update(
+        {'_id': computed['_id']},
+        {'$set': {'student_knowledge_base': computed['student_knowledge_base']}},
+        projection={'_id': 0, 'student_knowledge_base': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not student_data:
         print("Student knowledge base does not exist")
         return False
 
     print("Student knowledge base updated")
-    return True
+    return student_data['student_knowledge_base']
+
+
+def refresh_project_knowledge_bases(project_name: str, client: MongoDBClient = None):
+    """
+    Batch mode: recomputes the knowledge base of every student of a project
+    in one aggregation that writes the results back with $merge. Students
+    without known keywords keep their current knowledge base.
+    """
+    client = client or MongoDBClient()
+    ensure_topic_index(client.select_collection('keywords'))
+    student_col = client.select_collection('test1')
+    student_col.aggregate(knowledge_base_pipeline({'project_name': project_name}) + [
+        {'$merge': {'into': 'test1', 'on': '_id', 'whenMatched': 'merge', 'whenNotMatched': 'discard'}},
+    ], allowDiskUse=True)
+    print(f"Student knowledge bases of project '{project_name}' refreshed")
 
 
 def update_planning_graph(student_id: int, project_name: str):
     """
     Update the planning graph in the database by checking known topics and keywords semantic similarity in student knowledge base
     """
-    if update_student_knowledge_base(student_id, project_name):
-        print("Planning graph updated")
-    else:
+    # the knowledge base sorted by knowledge level, which will be used to update the planning graph at frontend
+    student_knowledge_base = update_student_knowledge_base(student_id, project_name)
+    if not student_knowledge_base:
         print("No planning graph to update")
         return False
 
-    # return the student knowledge base which will be used to update the planning graph at frontend
-    client = MongoDBClient()
-    student_col = client.select_collection('test1')
-    student_data = student_col.find_one({'student_id': student_id, 'project_name': project_name})
-    print("Student data-1:", student_data)
-    if student_data:
-        student_knowledge_base = student_data.get('student_knowledge_base', [])
-        # sort by knowledge level
-        student_knowledge_base.sort(key=lambda x: x['score'], reverse=True)
-        return student_knowledge_base
-    else:
-        print("Student knowledge base does not exist")
-        return False
+    print("Planning graph updated")
+    return student_knowledge_base
 
 
 # Agent to update the knowledge base and planning graph
@@ -0,0 +1,62 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire `ttl_seconds` after they were set.
+
+    `on_evict(key, value)` is called for entries dropped because they expired or
+    because the cache was full, so owners can release what the value holds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300, on_evict=None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, key):
+        _, value = self._entries.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def _purge_expired(self, now):
+        for key in [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            self._evict(key)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                self._evict(key)
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(key, None)
+            if len(self._entries) >= self.max_size:
+                self._purge_expired(now)
+            while len(self._entries) >= self.max_size:
+                self._evict(next(iter(self._entries)))
+            self._entries[key] = (now + self.ttl_seconds, value)
+
+    def pop(self, key, default=None):
+        """Removes an entry without calling on_evict."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
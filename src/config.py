@@ -17,4 +17,8 @@ INDEX_PATH = os.getenv("INDEX_PATH", "faiss.index")
 
 GEMINI_EMB_MODEL = os.getenv("GEMINI_EMB_MODEL", "gemini-embedding-exp-03-07")
 GEMINI_CHAT_MODEL=os.getenv("GEMINI_CHAT_MODEL", "gemini-2.0-flash-001")
-SEGMENT_SIZE = int(os.getenv("SEGMENT_SIZE", 1000))
\ No newline at end of file
+SEGMENT_SIZE = int(os.getenv("SEGMENT_SIZE", 1000))
+# Estimated tokens of document content sent to the study-graph LLM
+STUDY_GRAPH_CONTEXT_TOKENS = int(os.getenv("STUDY_GRAPH_CONTEXT_TOKENS", 8000))
+# "clusters": one representative segment per embedding cluster; "pages": budget split across files and pages
+STUDY_GRAPH_CONTEXT_STRATEGY = os.getenv("STUDY_GRAPH_CONTEXT_STRATEGY", "clusters")
\ No newline at end of file
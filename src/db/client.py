@@ -1,16 +1,82 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 import os
+import threading
 from dotenv import load_dotenv
 
+load_dotenv()
+
+# Connection pool of the shared client, per server
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 300000))
+
+# One MongoClient per URI for the whole process, created on first use
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def _forget_clients():
+    """
+    Drops the clients inherited from the parent process. Their sockets and
+    monitor threads belong to the parent, so the child creates its own on
+    first use; the inherited ones are not closed, which would affect the parent.
+    """
+    global _clients, _clients_pid, _clients_lock
+    _clients = {}
+    _clients_pid = os.getpid()
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients)
+
+
+def get_client(uri: str = None) -> MongoClient:
+    """
+    Returns the process-wide MongoClient for `uri` (MONGODB_URI by default),
+    creating it on first use. MongoClient is thread-safe and pools its
+    connections, so every caller shares one pool, TLS session and set of
+    server monitors instead of opening its own.
+    """
+    uri = uri or os.getenv("MONGODB_URI")
+    # Fallback for platforms without register_at_fork
+    if _clients_pid != os.getpid():
+        _forget_clients()
+    client = _clients.get(uri)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(uri)
+            if client is None:
+                client = MongoClient(
+                    uri,
+                    server_api=ServerApi("1"),
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                )
+                _clients[uri] = client
+    return client
+
+
+def close_all():
+    """Closes every shared client, e.g. at application shutdown. Later calls create new ones."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
 
 class MongoDBClient:
+    """
+    Cheap handle on the shared client: creating one opens no connection, and
+    its database and collections are lightweight views on the shared pool.
+    """
+
     def __init__(self):
-        load_dotenv()
-        self.client = MongoClient(
-            os.getenv("MONGODB_URI"),
-            server_api=ServerApi("1")
-        )
+        self.client = get_client()
         self.db = self.client[os.getenv("MONGODB_DB_NAME")]
         self.collection = self.db[os.getenv("MONGODB_COLLECTION_NAME")]
 
@@ -18,7 +84,8 @@ class MongoDBClient:
         return self.collection
 
     def close(self):
-        self.client.close()
+        # The client is shared with the rest of the process; close_all() closes it at shutdown
+        pass
 
     def select_collection(self, collection_name):
         self.collection = self.db[collection_name]
@@ -0,0 +1,119 @@
+import math
+
+from documents.segment_index import build_segment_filter
+
+# Rough size of a Gemini token in characters, good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def fair_shares(demands: list, budget: int) -> list:
+    """
+    Max-min fair split of `budget` between `demands`: every demand gets an
+    equal share, and what small demands leave unused is split again between
+    the larger ones.
+    """
+    shares = [0] * len(demands)
+    order = sorted(range(len(demands)), key=lambda i: demands[i])
+    for position, smallest in enumerate(order):
+        left = len(order) - position
+        share = budget // left
+        if demands[smallest] <= share:
+            shares[smallest] = demands[smallest]
+            budget -= demands[smallest]
+            continue
+        remaining = order[position:]
+        for i in remaining:
+            shares[i] = share
+        # Hand out what integer division left over, one character each
+        for i in remaining[:budget - share * left]:
+            shares[i] += 1
+        break
+    return shares
+
+
+def _page_header(file_name, page_number) -> str:
+    return f"- {file_name} (p{page_number}): "
+
+
+def build_context(segments_col, std_id, project_name, token_budget: int, file_names=None) -> str:
+    """
+    Builds the study-graph context of a student project within `token_budget`
+    (estimated) tokens.
+
+    The budget is split fairly between files, then between the pages of each
+    file, so a long file cannot crowd out the others and every page gets a
+    line while the budget allows. Page sizes are computed server-side first;
+    the segment texts are then streamed in reading order, projected to the
+    needed fields and cut to the page allocation on the server.
+
+    Returns one "- file (pN): text" line per page.
+    """
+    match = build_segment_filter(std_id=std_id, project_name=project_name, file_names=file_names)
+
+    # 1. Characters per page, without transferring any text
+    page_sizes = {}
+    for row in segments_col.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"file_name": "$file_name", "page_number": "$page_number"},
+            "chars": {"$sum": {"$strLenCP": {"$ifNull": ["$text", ""]}}},
+        }},
+    ]):
+        key = (row["_id"]["file_name"], row["_id"]["page_number"])
+        page_sizes[key] = len(_page_header(*key)) + row["chars"] + 1
+    if not page_sizes:
+        return ""
+
+    # 2. Fair allocation of the character budget: files first, then pages within a file
+    pages_by_file = {}
+    for file_name, page_number in sorted(page_sizes, key=lambda key: (str(key[0]), key[1] or 0)):
+        pages_by_file.setdefault(file_name, []).append(page_number)
+    files = list(pages_by_file)
+    file_shares = fair_shares(
+        [sum(page_sizes[(f, p)] for p in pages_by_file[f]) for f in files],
+        token_budget * CHARS_PER_TOKEN
+    )
+    allocations = {}
+    for file_name, file_share in zip(files, file_shares):
+        pages = pages_by_file[file_name]
+        for page_number, page_share in zip(pages, fair_shares([page_sizes[(file_name, p)] for p in pages],
+                                                              file_share)):
+            # Pages whose share cannot hold more than their header are left out
+            text_chars = page_share - len(_page_header(file_name, page_number)) - 1
+            if text_chars > 0:
+                allocations[(file_name, page_number)] = text_chars
+    if not allocations:
+        return ""
+
+    # 3. Stream the texts in reading order, each cut on the server to the largest page allocation
+    page_texts = {key: [] for key in allocations}
+    remaining = dict(allocations)
+    cursor = segments_col.aggregate([
+        {"$match": match},
+        {"$sort": {"file_name": 1, "page_number": 1, "segment_index": 1}},
+        {"$project": {
+            "_id": 0,
+            "file_name": 1,
+            "page_number": 1,
+            "text": {"$substrCP": [{"$ifNull": ["$text", ""]}, 0, max(allocations.values())]},
+        }},
+    ], allowDiskUse=True)
+    for seg in cursor:
+        key = (seg["file_name"], seg["page_number"])
+        if remaining.get(key, 0) <= 0:
+            continue
+        text = " ".join(seg["text"].split())[:remaining[key]]
+        page_texts[key].append(text)
+        remaining[key] -= len(text) + 1
+
+    lines = []
+    for file_name in files:
+        for page_number in pages_by_file[file_name]:
+            texts = page_texts.get((file_name, page_number))
+            if texts:
+                lines.append(_page_header(file_name, page_number) + " ".join(texts))
+    return "\n".join(lines)
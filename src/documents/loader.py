@@ -1,21 +1,16 @@
 import os
-import time
 import sys
 
 import fitz
 from dotenv import load_dotenv
-from google import genai
-from google.genai.types import EmbedContentConfig
 # from ..config import GEMINI_EMB_MODEL,GOOGLE_API_KEY, SEGMENT_SIZE, COLLECTIONS_DIR
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from config import GEMINI_EMB_MODEL,GOOGLE_API_KEY, SEGMENT_SIZE, COLLECTIONS_DIR
+from config import SEGMENT_SIZE, COLLECTIONS_DIR
 from db.client import MongoDBClient
+from embeddings import EMBEDDING_MODEL, embed_texts
 
 load_dotenv()
 
-# Initialize GenAI client
-gemini_ai_client = genai.Client(api_key=GOOGLE_API_KEY)
-
 
 def ingest_pdfs(std_id: int, project_name: str, folder_path=COLLECTIONS_DIR):
     """
@@ -39,38 +34,41 @@ def ingest_pdfs(std_id: int, project_name: str, folder_path=COLLECTIONS_DIR):
             page = doc.load_page(page_num)
             page_text = page.get_text()
 
+            page_segments = []
             for idx in range(0, len(page_text), SEGMENT_SIZE):
-                time.sleep(0.5)
                 seg_text = page_text[idx: idx + SEGMENT_SIZE].strip()
                 print("Segment text:", seg_text)
                 if not seg_text:
                     continue
-                # Generate embedding
-                resp = gemini_ai_client.models.embed_content(
-                    model=GEMINI_EMB_MODEL,
-                    contents=[seg_text],
-                    config=EmbedContentConfig(task_type="RETRIEVAL_DOCUMENT"),
-                )
-                vec = resp.embeddings[0].values
+                page_segments.append((idx // SEGMENT_SIZE, seg_text))
+            if not page_segments:
+                continue
+
+            # Embed the whole page in one batched call
+            vectors = embed_texts([seg_text for _, seg_text in page_segments],
+                                  task_type="RETRIEVAL_DOCUMENT")
 
-                # Insert into MongoDB
-                doc_record = {
+            # Insert into MongoDB
+            doc_records = []
+            for (segment_index, seg_text), vec in zip(page_segments, vectors):
+                doc_records.append({
                     "std_id": std_id,
                     "project_name": project_name,
                     "file_name": fname,
                     "page_number": page_num + 1,
-                    "segment_index": idx // SEGMENT_SIZE,
+                    "segment_index": segment_index,
                     "text": seg_text,
-                    "embedding": list(vec)
-                }
-                segments_col.insert_one(doc_record)
+                    "embedding": list(vec),
+                    "embedding_model": EMBEDDING_MODEL
+                })
+            segments_col.insert_many(doc_records)
         doc.close()
 
     # Update student knowledge base record
     students_col = db.select_collection("test1")
     students_col.update_one(
-        {"std_id": std_id},
-        {"$set": {"project_name": project_name, "files": files}},
+        {"student_id": std_id, "project_name": project_name},
+        {"$set": {"files": files}},
         upsert=True
     )
     print(f"Ingested {len(files)} files for student {std_id} in project '{project_name}'")
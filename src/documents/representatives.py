@@ -0,0 +1,156 @@
+import numpy as np
+
+from embeddings import EMBEDDING_MODEL
+from documents.segment_index import build_segment_filter
+from documents.context_builder import CHARS_PER_TOKEN
+
+# Embeddings are clustered after a random projection to this many dimensions
+PROJECTION_DIM = 64
+# Characters of each representative segment put in the context
+REPRESENTATIVE_CHARS = 400
+
+
+def random_projection(dim: int, out_dim: int = PROJECTION_DIM, seed: int = 0) -> np.ndarray:
+    """Gaussian projection matrix; pairwise distances are roughly preserved (Johnson-Lindenstrauss)."""
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal((dim, out_dim)) / np.sqrt(out_dim)).astype(np.float32)
+
+
+def _squared_distances(points: np.ndarray, centroids: np.ndarray, point_norms: np.ndarray = None) -> np.ndarray:
+    if point_norms is None:
+        point_norms = (points * points).sum(axis=1)
+    distances = points @ centroids.T
+    distances *= -2.0
+    distances += point_norms[:, None]
+    distances += (centroids * centroids).sum(axis=1)[None, :]
+    return np.maximum(distances, 0.0, out=distances)
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 25, seed: int = 0):
+    """
+    Lloyd's k-means with k-means++ seeding, vectorized over all points.
+    Returns (centroids, labels).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(points)
+    k = min(k, n)
+    point_norms = (points * points).sum(axis=1)
+
+    # k-means++: each next centroid is drawn proportionally to its squared distance to the closest one
+    centroids = np.empty((k, points.shape[1]), dtype=points.dtype)
+    centroids[0] = points[rng.integers(n)]
+    closest = _squared_distances(points, centroids[:1], point_norms)[:, 0]
+    for c in range(1, k):
+        cumulative = np.cumsum(closest)
+        if cumulative[-1] > 0:
+            index = min(int(np.searchsorted(cumulative, rng.random() * cumulative[-1])), n - 1)
+        else:
+            index = rng.integers(n)
+        centroids[c] = points[index]
+        np.minimum(closest, _squared_distances(points, centroids[c:c + 1], point_norms)[:, 0], out=closest)
+
+    labels = np.zeros(n, dtype=np.int64)
+    rows = np.arange(n)
+    for i in range(iterations):
+        new_labels = _squared_distances(points, centroids, point_norms).argmin(axis=1)
+        if i and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        # Per-cluster sums as one matrix product with the one-hot assignment matrix
+        assignment = np.zeros((k, n), dtype=points.dtype)
+        assignment[labels, rows] = 1.0
+        sums = assignment @ points
+        counts = np.bincount(labels, minlength=k)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids, labels
+
+
+def representative_indices(points: np.ndarray, k: int, per_cluster: int = 1, seed: int = 0) -> list:
+    """
+    Clusters `points` into k clusters and returns the rows of the `per_cluster`
+    points closest to each centroid, largest clusters first.
+    """
+    if not len(points):
+        return []
+    centroids, labels = kmeans(points, k, seed=seed)
+    distances = _squared_distances(points, centroids)[np.arange(len(points)), labels]
+    clusters = np.bincount(labels, minlength=len(centroids))
+
+    selected = []
+    for cluster in np.argsort(-clusters, kind="stable"):
+        members = np.flatnonzero(labels == cluster)
+        if len(members):
+            selected.extend(members[np.argsort(distances[members])[:per_cluster]].tolist())
+    return selected
+
+
+def load_projected_embeddings(segments_col, match: dict, batch_size: int = 2000, seed: int = 0):
+    """
+    Streams the segment embeddings matching `match` and projects them batch by
+    batch, so full-size vectors are never held for the whole project.
+    Returns (segment ids, projected embeddings).
+    """
+    ids, projected, batch, projection = [], [], [], None
+    cursor = segments_col.find(match, {"_id": 1, "embedding": 1}, batch_size=batch_size)
+
+    def flush():
+        nonlocal projection
+        vectors = np.asarray(batch, dtype=np.float32)
+        if projection is None:
+            projection = random_projection(vectors.shape[1], seed=seed)
+        projected.append(vectors @ projection)
+        batch.clear()
+
+    for seg in cursor:
+        if not seg.get("embedding"):
+            continue
+        ids.append(seg["_id"])
+        batch.append(seg["embedding"])
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if not projected:
+        return [], np.empty((0, PROJECTION_DIM), dtype=np.float32)
+    points = np.vstack(projected)
+    # Cosine geometry: cluster directions, not magnitudes
+    points /= np.maximum(np.linalg.norm(points, axis=1, keepdims=True), 1e-12)
+    return ids, points
+
+
+def build_representative_context(segments_col, std_id, project_name, token_budget: int,
+                                 chars_per_segment: int = REPRESENTATIVE_CHARS, seed: int = 0) -> str:
+    """
+    Builds the study-graph context from representative segments: the project's
+    segment embeddings are clustered and the segment closest to each cluster
+    centre is kept. The number of clusters follows the token budget, so the
+    prompt size stays constant while every topic of a large project is covered.
+
+    Returns "- file (pN): text" lines in reading order, or "" when the project
+    has no segments embedded with the current model.
+    """
+    match = build_segment_filter(std_id=std_id, project_name=project_name, embedding_model=EMBEDDING_MODEL)
+    ids, points = load_projected_embeddings(segments_col, match, seed=seed)
+    if not ids:
+        return ""
+
+    # Room for the header of each line as well as its text
+    k = max(1, (token_budget * CHARS_PER_TOKEN) // (chars_per_segment + 40))
+    selected = [ids[i] for i in representative_indices(points, k, seed=seed)]
+
+    segments = segments_col.aggregate([
+        {"$match": {"_id": {"$in": selected}}},
+        {"$sort": {"file_name": 1, "page_number": 1, "segment_index": 1}},
+        {"$project": {
+            "_id": 0,
+            "file_name": 1,
+            "page_number": 1,
+            "text": {"$substrCP": [{"$ifNull": ["$text", ""]}, 0, chars_per_segment]},
+        }},
+    ])
+    return "\n".join(
+        f"- {seg['file_name']} (p{seg['page_number']}): {' '.join(seg['text'].split())}"
+        for seg in segments
+    )
@@ -1,43 +1,74 @@
-from google import genai
+import os
+
 import numpy as np
-from google.genai.types import EmbedContentConfig
-from config import GEMINI_EMB_MODEL,GOOGLE_API_KEY, SEGMENT_SIZE, COLLECTIONS_DIR
 from db.client import MongoDBClient
+from cache import TTLCache
+from embeddings import EMBEDDING_MODEL, embed_text
+from documents.segment_index import SegmentIndex, build_segment_filter
+
+# Each cached index holds a project's embedding matrix and segment texts, so only the recent ones are kept
+SEGMENT_INDEX_CACHE_SIZE = int(os.getenv("SEGMENT_INDEX_CACHE_SIZE", 32))
+SEGMENT_INDEX_CACHE_TTL = float(os.getenv("SEGMENT_INDEX_CACHE_TTL", 1800))
+
+# (std_id, project_name) -> (segments version, SegmentIndex)
+segment_index_cache = TTLCache(max_size=SEGMENT_INDEX_CACHE_SIZE, ttl_seconds=SEGMENT_INDEX_CACHE_TTL)
+
+
+def segments_version(segments_col, scope: dict) -> tuple:
+    """
+    Cheap change signal for the segments matching `scope`: their count and
+    largest _id. Ingesting adds segments with new, larger ids and removing
+    segments lowers the count, so re-ingesting or replacing a file changes
+    the version even when the segment count stays the same.
+    """
+    latest = segments_col.find_one(scope, {"_id": 1}, sort=[("_id", -1)])
+    return segments_col.count_documents(scope), latest["_id"] if latest else None
 
 
-def retrieve(std_id: int, project_name: str, query: str, top_k: int = 5):
+def get_segment_index(segments_col, std_id: int, project_name: str) -> SegmentIndex:
+    """
+    Returns the cached SegmentIndex for a student project, rebuilding it when
+    its segments changed since it was built. Only segments embedded with the
+    current embedding model are indexed.
+    """
+    scope = build_segment_filter(std_id=std_id, project_name=project_name,
+                                 embedding_model=EMBEDDING_MODEL)
+    version = segments_version(segments_col, scope)
+    cached = segment_index_cache.get((std_id, project_name))
+    if cached and cached[0] == version:
+        return cached[1]
+
+    projection = {"_id": 0, "std_id": 1, "file_name": 1, "page_number": 1,
+                  "segment_index": 1, "text": 1, "embedding": 1}
+    index = SegmentIndex(list(segments_col.find(scope, projection)))
+    segment_index_cache.set((std_id, project_name), (version, index))
+    return index
+
+
+def retrieve(std_id: int, project_name: str, query: str, top_k: int = 5,
+             file_names=None, page_range=None):
     """
     Embed query, then compute cosine similarity against stored segments.
     Returns top_k segments with metadata including page numbers.
+
+    file_names and page_range (first, last; inclusive) restrict the search,
+    e.g. retrieve(1, "ml", "bayes", file_names=["ch3.pdf"], page_range=(10, 25)).
     """
     db = MongoDBClient()
-    print(type(db))
     segments_col = db.select_collection("documents_segments")
-    segments = list(segments_col.find({"std_id": std_id, "project_name": project_name}))
-    if not segments:
+    index = get_segment_index(segments_col, std_id, project_name)
+    if not len(index):
         return []
 
     # Embed query
-    client = genai.Client(api_key=GOOGLE_API_KEY)
-    resp = client.models.embed_content(
-        model=GEMINI_EMB_MODEL,
-        contents=[query],
-        config=EmbedContentConfig(task_type="RETRIEVAL_QUERY"),
-    )
-    q_vec = np.array(resp.embeddings[0].values, dtype='float32')
-
-    # Compute similarities
-    sims = []
-    for seg in segments:
-        emb = np.array(seg['embedding'], dtype='float32')
-        cosine = float(np.dot(q_vec, emb) / (np.linalg.norm(q_vec) * np.linalg.norm(emb)))
-        sims.append((cosine, seg))
-
-    sims.sort(key=lambda x: x[0], reverse=True)
+    q_vec = np.array(embed_text(query, task_type="RETRIEVAL_QUERY"), dtype='float32')
+
+    # Score only the rows matching the metadata filters
+    sims = index.search(q_vec, top_k=top_k, file_names=file_names, page_range=page_range)
 
     # Return top_k with page info
     results = []
-    for score, seg in sims[:top_k]:
+    for score, seg in sims:
         results.append({
             "score": score,
             "file": seg['file_name'],
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+def build_segment_filter(std_id=None, project_name=None, file_names=None, page_range=None,
+                         embedding_model=None):
+    """
+    Build a MongoDB filter for document segments.
+
+    The same dict is valid as a `find` filter and as an Atlas `$vectorSearch`
+    `filter` clause (only $eq, $in, $gte, $lte and $and are used), so both
+    engines scope a search identically.
+
+    Args:
+      std_id: Student identifier
+      project_name: e.g. "my_course"
+      file_names: file name or list of file names to search within
+      page_range: (first_page, last_page), both inclusive, either may be None
+      embedding_model: only match vectors produced by this embedding model
+    """
+    clauses = []
+    if embedding_model is not None:
+        clauses.append({"embedding_model": {"$eq": embedding_model}})
+    if std_id is not None:
+        clauses.append({"std_id": {"$eq": std_id}})
+    if project_name is not None:
+        clauses.append({"project_name": {"$eq": project_name}})
+    if file_names:
+        if isinstance(file_names, str):
+            file_names = [file_names]
+        clauses.append({"file_name": {"$in": list(file_names)}})
+    if page_range:
+        first_page, last_page = page_range
+        if first_page is not None:
+            clauses.append({"page_number": {"$gte": first_page}})
+        if last_page is not None:
+            clauses.append({"page_number": {"$lte": last_page}})
+
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+class SegmentIndex:
+    """
+    In-memory embedding matrix over stored segments with precomputed
+    metadata masks, so filtered searches only score the matching rows.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        if segments:
+            matrix = np.array([seg['embedding'] for seg in segments], dtype='float32')
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+            self.embeddings = matrix
+        else:
+            self.embeddings = np.zeros((0, 0), dtype='float32')
+        self.page_numbers = np.array([seg.get('page_number', 0) for seg in segments], dtype='int32')
+
+        # Bitmap masks for the categorical fields, built once per index
+        self.file_masks = self._build_masks([seg.get('file_name') for seg in segments])
+        self.student_masks = self._build_masks([seg.get('std_id') for seg in segments])
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _build_masks(self, values):
+        masks = {}
+        for row, value in enumerate(values):
+            if value not in masks:
+                masks[value] = np.zeros(len(values), dtype=bool)
+            masks[value][row] = True
+        return masks
+
+    def mask(self, std_id=None, file_names=None, page_range=None):
+        """
+        Returns a boolean row mask for the given filters, or None when unfiltered.
+        """
+        mask = None
+        if std_id is not None:
+            mask = self.student_masks.get(std_id, np.zeros(len(self), dtype=bool)).copy()
+        if file_names:
+            if isinstance(file_names, str):
+                file_names = [file_names]
+            file_mask = np.zeros(len(self), dtype=bool)
+            for fname in file_names:
+                if fname in self.file_masks:
+                    file_mask |= self.file_masks[fname]
+            mask = file_mask if mask is None else mask & file_mask
+        if page_range:
+            first_page, last_page = page_range
+            page_mask = np.ones(len(self), dtype=bool)
+            if first_page is not None:
+                page_mask &= self.page_numbers >= first_page
+            if last_page is not None:
+                page_mask &= self.page_numbers <= last_page
+            mask = page_mask if mask is None else mask & page_mask
+        return mask
+
+    def search(self, query_vector, top_k=5, std_id=None, file_names=None, page_range=None):
+        """
+        Cosine similarity search restricted to the rows matching the filters.
+        Returns a list of (score, segment) pairs, best first.
+        """
+        if not len(self):
+            return []
+        q_vec = np.asarray(query_vector, dtype='float32')
+        q_norm = np.linalg.norm(q_vec)
+        if q_norm:
+            q_vec = q_vec / q_norm
+
+        rows = None
+        mask = self.mask(std_id=std_id, file_names=file_names, page_range=page_range)
+        if mask is not None:
+            rows = np.flatnonzero(mask)
+            if not rows.size:
+                return []
+            scores = self.embeddings[rows] @ q_vec
+        else:
+            scores = self.embeddings @ q_vec
+
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if rows is not None:
+            return [(float(scores[i]), self.segments[rows[i]]) for i in top]
+        return [(float(scores[i]), self.segments[i]) for i in top]
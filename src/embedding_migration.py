@@ -0,0 +1,199 @@
+"""
+Background re-embedding of a collection into a new embedding model.
+
+New vectors are written next to the live ones (`embedding_pending`,
+`embedding_pending_model`), so searches keep using the current space while the
+job runs. Once every document has a pending vector, `cutover` swaps them in
+with a single server-side update; deploy the new GEMINI_EMB_MODEL together
+with the cutover so queries and stored vectors switch spaces at the same time.
+
+The job is resumable: it only selects documents without a pending vector for
+the target model, and its progress is stored in the `embedding_migrations`
+collection.
+
+Usage:
+    python src/embedding_migration.py keywords --target-model gemini-embedding-exp-03-07
+    python src/embedding_migration.py documents_segments --target-model text-embedding-005 --rate 20
+    python src/embedding_migration.py documents_segments --target-model text-embedding-005 --cutover
+    python src/embedding_migration.py keywords --tag-untagged gemini-embedding-exp-03-07
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from db.client import MongoDBClient
+from embeddings import embed_texts
+
+MIGRATIONS_COLLECTION = "embedding_migrations"
+
+# Text field and Gemini task type used to embed each collection
+EMBEDDED_FIELDS = {
+    "documents_segments": ("text", "RETRIEVAL_DOCUMENT"),
+    "keywords": ("keyword", None),
+}
+
+
+class EmbeddingMigration:
+    """
+    Re-embeds `collection_name` into `target_model` in throttled batches.
+    """
+
+    def __init__(self, collection_name: str, target_model: str, batch_size: int = 64,
+                 max_docs_per_second: float = None, progress_callback=None):
+        if collection_name not in EMBEDDED_FIELDS:
+            raise ValueError(f"No embedded text field known for collection '{collection_name}'")
+        self.collection_name = collection_name
+        self.target_model = target_model
+        self.text_field, self.task_type = EMBEDDED_FIELDS[collection_name]
+        self.batch_size = batch_size
+        self.max_docs_per_second = max_docs_per_second
+        self.progress_callback = progress_callback
+        self._stop = threading.Event()
+
+        db = MongoDBClient()
+        self.collection = db.select_collection(collection_name)
+        self.state_col = db.select_collection(MIGRATIONS_COLLECTION)
+        self.state_id = f"{collection_name}:{target_model}"
+
+    def _pending_query(self):
+        return {
+            "embedding_model": {"$ne": self.target_model},
+            "embedding_pending_model": {"$ne": self.target_model},
+        }
+
+    def progress(self) -> dict:
+        """Returns the stored progress of this migration."""
+        return self.state_col.find_one({"_id": self.state_id}) or {}
+
+    def _report(self, **fields):
+        fields["updated_at"] = datetime.now()
+        self.state_col.update_one(
+            {"_id": self.state_id},
+            {"$set": fields, "$setOnInsert": {"collection": self.collection_name,
+                                              "target_model": self.target_model,
+                                              "started_at": datetime.now()}},
+            upsert=True
+        )
+        state = self.progress()
+        print(f"[{self.state_id}] {state.get('status')}: {state.get('processed', 0)}/{state.get('total', 0)}")
+        if self.progress_callback:
+            self.progress_callback(state)
+
+    def stop(self):
+        """Ask a running migration to stop after the current batch; it can be resumed later."""
+        self._stop.set()
+
+    def run(self) -> dict:
+        """
+        Re-embeds every document not yet in the target space. Returns the final progress.
+        """
+        already_done = self.collection.count_documents({"embedding_pending_model": self.target_model})
+        remaining = self.collection.count_documents(self._pending_query())
+        self._report(status="running", processed=already_done, total=already_done + remaining)
+
+        processed = already_done
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                batch = list(self.collection.find(
+                    self._pending_query(),
+                    {"_id": 1, self.text_field: 1}
+                ).sort("_id", 1).limit(self.batch_size))
+                if not batch:
+                    break
+
+                texts = [doc.get(self.text_field) or "" for doc in batch]
+                vectors = embed_texts(texts, task_type=self.task_type, model=self.target_model)
+                self.collection.bulk_write([
+                    UpdateOne({"_id": doc["_id"]},
+                              {"$set": {"embedding_pending": list(vec),
+                                        "embedding_pending_model": self.target_model}})
+                    for doc, vec in zip(batch, vectors)
+                ], ordered=False)
+
+                processed += len(batch)
+                self._report(processed=processed)
+
+                # Throttle so a migration never starves live traffic of embedding quota
+                if self.max_docs_per_second:
+                    min_duration = len(batch) / self.max_docs_per_second
+                    elapsed = time.monotonic() - started
+                    if elapsed < min_duration:
+                        time.sleep(min_duration - elapsed)
+        except Exception as e:
+            self._report(status="failed", error=str(e))
+            raise
+
+        if self._stop.is_set():
+            self._report(status="stopped")
+        else:
+            self._report(status="completed", total=processed)
+        return self.progress()
+
+    def start_in_background(self) -> threading.Thread:
+        """Runs the migration in a daemon thread and returns it."""
+        thread = threading.Thread(target=self.run, name=f"embedding-migration-{self.state_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def cutover(self) -> int:
+        """
+        Promotes the pending vectors to `embedding` once every document has one.
+        Returns the number of documents switched to the target model.
+        """
+        remaining = self.collection.count_documents(self._pending_query())
+        if remaining:
+            raise RuntimeError(f"{remaining} documents still need re-embedding, run the migration first")
+
+        result = self.collection.update_many(
+            {"embedding_pending_model": self.target_model},
+            [
+                {"$set": {"embedding": "$embedding_pending", "embedding_model": "$embedding_pending_model"}},
+                {"$unset": ["embedding_pending", "embedding_pending_model"]},
+            ]
+        )
+        self._report(status="cut_over", switched=result.modified_count)
+        return result.modified_count
+
+
+def tag_untagged(collection_name: str, model: str) -> int:
+    """
+    Marks vectors stored before model tagging existed as produced by `model`.
+    Only use it when that model really produced them; otherwise migrate instead.
+    """
+    collection = MongoDBClient().select_collection(collection_name)
+    result = collection.update_many(
+        {"embedding": {"$exists": True}, "embedding_model": {"$exists": False}},
+        {"$set": {"embedding_model": model}}
+    )
+    print(f"Tagged {result.modified_count} documents in '{collection_name}' with model '{model}'")
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed a collection into a new embedding model")
+    parser.add_argument("collection", choices=sorted(EMBEDDED_FIELDS))
+    parser.add_argument("--target-model", help="Embedding model to migrate to")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=None, help="Maximum documents re-embedded per second")
+    parser.add_argument("--cutover", action="store_true", help="Promote pending vectors instead of migrating")
+    parser.add_argument("--tag-untagged", metavar="MODEL", help="Tag untagged vectors with MODEL and exit")
+    args = parser.parse_args()
+
+    if args.tag_untagged:
+        tag_untagged(args.collection, args.tag_untagged)
+    elif not args.target_model:
+        parser.error("--target-model is required")
+    else:
+        migration = EmbeddingMigration(args.collection, args.target_model,
+                                       batch_size=args.batch_size, max_docs_per_second=args.rate)
+        if args.cutover:
+            migration.cutover()
+        else:
+            migration.run()
@@ -0,0 +1,75 @@
+import os
+import threading
+
+from google.genai.types import EmbedContentConfig
+from config import GEMINI_EMB_MODEL
+from genai_client import call_with_retries, get_client
+from singleflight import get_group, make_key
+
+# Single place the embedding model is resolved; every stored and query vector uses it.
+# Stored vectors carry it in their `embedding_model` field and searches only match it.
+EMBEDDING_MODEL = GEMINI_EMB_MODEL
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", 8))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 5))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", 0.5))
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", 20.0))
+
+_semaphore = threading.BoundedSemaphore(EMBED_MAX_CONCURRENCY)
+
+# Identical concurrent embedding requests share one upstream call
+_embed_flight = get_group("embeddings")
+
+
+def _reset_after_fork():
+    """Forked workers must not inherit the parent's semaphore state."""
+    global _semaphore
+    _semaphore = threading.BoundedSemaphore(EMBED_MAX_CONCURRENCY)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _embed_batch(texts: list[str], task_type: str = None, model: str = None) -> list[list[float]]:
+    """Embed one batch under the per-process concurrency limit."""
+    config = EmbedContentConfig(task_type=task_type) if task_type else None
+
+    def embed():
+        with _semaphore:
+            return get_client().models.embed_content(
+                model=model or EMBEDDING_MODEL,
+                contents=texts,
+                config=config,
+            )
+
+    result = call_with_retries(embed, EMBED_MAX_RETRIES, EMBED_BACKOFF_BASE, EMBED_BACKOFF_MAX)
+    return [list(emb.values) for emb in result.embeddings]
+
+
+def _embed_coalesced(texts: list[str], task_type: str = None, model: str = None) -> list[list[float]]:
+    model = model or EMBEDDING_MODEL
+    key = make_key(model, {"texts": texts, "task_type": task_type})
+    # Copy so callers sharing a coalesced result cannot mutate each other's vectors
+    return [list(vec) for vec in _embed_flight.do(key, _embed_batch, texts, task_type, model)]
+
+
+def embed_texts(texts: list[str], task_type: str = None, model: str = None) -> list[list[float]]:
+    """
+    Generate embeddings for a list of texts, split into batches of EMBED_BATCH_SIZE.
+
+    Args:
+      texts: texts to embed
+      task_type: optional Gemini task type, e.g. "RETRIEVAL_DOCUMENT" or "RETRIEVAL_QUERY"
+      model: embedding model override, only used when migrating to a new model
+    """
+    embeddings = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        embeddings.extend(_embed_coalesced(texts[start:start + EMBED_BATCH_SIZE], task_type, model))
+    return embeddings
+
+
+def embed_text(text: str, task_type: str = None, model: str = None) -> list[float]:
+    """Generate the embedding for a single text."""
+    return _embed_coalesced([text], task_type, model)[0]
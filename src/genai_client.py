@@ -0,0 +1,59 @@
+import os
+import time
+import random
+import threading
+
+import httpx
+from google import genai
+from google.genai import errors
+from config import GOOGLE_API_KEY
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Forked workers must not reuse the parent's HTTP connections."""
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client() -> genai.Client:
+    """
+    Returns the process-wide genai client, created on first use so its
+    HTTP connection pool is shared by every caller (embeddings and chat).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = genai.Client(api_key=GOOGLE_API_KEY)
+    return _client
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError))
+
+
+def call_with_retries(fn, max_retries: int, backoff_base: float, backoff_max: float):
+    """
+    Call a Gemini API function, retrying rate limits and transient errors
+    up to max_retries times with jittered exponential backoff.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+            print(f"Gemini request failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
@@ -0,0 +1,53 @@
+import os
+import threading
+
+from google.genai.types import GenerateContentConfig
+from config import GEMINI_CHAT_MODEL
+from genai_client import call_with_retries, get_client
+from singleflight import get_group, make_key
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 20.0))
+
+_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+# Identical concurrent prompts share one upstream generation
+_chat_flight = get_group("chat")
+
+
+def _generate(prompt: str, response_schema, model: str, system_instruction: str = None):
+    config = GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+    )
+
+    def generate():
+        with _semaphore:
+            return get_client().models.generate_content(model=model, contents=prompt, config=config)
+
+    response = call_with_retries(generate, LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX)
+    if response.parsed is None:
+        raise ValueError(f"Model returned no {response_schema.__name__}: {response.text}")
+    return response.parsed
+
+
+def generate_structured(prompt: str, response_schema, model: str = None, system_instruction: str = None):
+    """
+    Single structured-output generation call on the shared genai client.
+
+    Args:
+      prompt: user content sent to the model
+      response_schema: pydantic model the response is parsed into
+      model: chat model, defaults to GEMINI_CHAT_MODEL
+      system_instruction: optional system instruction
+    Returns an instance of response_schema.
+    """
+    model = model or GEMINI_CHAT_MODEL
+    key = make_key(model, {"prompt": prompt, "schema": response_schema.__name__,
+                           "system_instruction": system_instruction})
+    parsed = _chat_flight.do(key, _generate, prompt, response_schema, model, system_instruction)
+    # Callers sharing a coalesced result get their own copy
+    return parsed.model_copy(deep=True)
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+
+# Every coalescing group by name, for reporting
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def make_key(model: str, payload) -> str:
+    """Key identical upstream requests by model and a hash of their payload."""
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return f"{model}:{hashlib.sha256(encoded).hexdigest()}"
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight,
+    later callers with the same key wait for it and share its result (or
+    exception) instead of issuing their own upstream request.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.deduplicated = 0
+
+    def do(self, key: str, fn, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                leader = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "upstream_calls": self.calls - self.deduplicated,
+                "deduplicated": self.deduplicated,
+                "in_flight": len(self._in_flight),
+            }
+
+
+def _reset_after_fork():
+    """Calls in flight in the parent never complete in a forked child."""
+    global _groups_lock
+    _groups_lock = threading.Lock()
+    for group in _groups.values():
+        group._lock = threading.Lock()
+        group._in_flight = {}
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_group(name: str) -> SingleFlight:
+    """Returns the process-wide coalescing group with this name."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def coalescing_stats() -> dict:
+    """Calls, upstream calls and deduplicated calls for every coalescing group."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,238 @@
+import heapq
+
+import numpy as np
+
+
+class CycleError(ValueError):
+    """Raised when a topological order is requested for a graph with a cycle."""
+
+    def __init__(self, cycle):
+        super().__init__(f"Study graph has a prerequisite cycle: {' -> '.join(map(str, cycle))}")
+        self.cycle = cycle
+
+
+def _csr(n: int, sources: np.ndarray, targets: np.ndarray):
+    """Offsets and neighbours of every node; the neighbours of i are neighbours[offsets[i]:offsets[i + 1]]."""
+    order = np.lexsort((targets, sources))
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return offsets, targets[order].astype(np.int32)
+
+
+class DependencyGraph:
+    """
+    Prerequisite graph of a study plan. Node ids are interned to 0..n-1 in the
+    order of `nodes_id`, and edges [source, target] ("source is a prerequisite
+    of target") are stored as CSR adjacency arrays in both directions.
+
+    Edges with an unknown end are not stored and are listed in `unknown_edges`;
+    duplicate edges are stored once.
+    """
+
+    def __init__(self, nodes_id, edges):
+        self.ids = list(dict.fromkeys(nodes_id))
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+        self.unknown_edges = []
+
+        pairs = set()
+        for edge in edges:
+            source, target = self.index.get(edge[0]), self.index.get(edge[1])
+            if source is None or target is None:
+                self.unknown_edges.append(list(edge))
+            else:
+                pairs.add((source, target))
+        pairs = sorted(pairs)
+        sources = np.array([s for s, _ in pairs], dtype=np.int32)
+        targets = np.array([t for _, t in pairs], dtype=np.int32)
+
+        n = len(self.ids)
+        self._out_offsets, self._out = _csr(n, sources, targets)
+        self._in_offsets, self._in = _csr(n, targets, sources)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self._out)
+
+    def successors(self, i: int) -> np.ndarray:
+        return self._out[self._out_offsets[i]:self._out_offsets[i + 1]]
+
+    def predecessors(self, i: int) -> np.ndarray:
+        return self._in[self._in_offsets[i]:self._in_offsets[i + 1]]
+
+    def edges(self) -> list:
+        """Stored edges as [source id, target id] pairs."""
+        return [[self.ids[s], self.ids[t]] for s in range(len(self)) for t in self.successors(s)]
+
+    def find_cycle(self):
+        """Returns the node ids of one cycle (first node repeated at the end), or None for a DAG."""
+        state = [0] * len(self)  # 0 unvisited, 1 on the DFS stack, 2 done
+        parent = [-1] * len(self)
+        for root in range(len(self)):
+            if state[root]:
+                continue
+            state[root] = 1
+            stack = [(root, 0)]
+            while stack:
+                node, position = stack[-1]
+                neighbours = self.successors(node)
+                if position == len(neighbours):
+                    state[node] = 2
+                    stack.pop()
+                    continue
+                stack[-1] = (node, position + 1)
+                child = int(neighbours[position])
+                if state[child] == 1:
+                    cycle = [child]
+                    while node != child:
+                        cycle.append(node)
+                        node = parent[node]
+                    cycle.reverse()
+                    return [self.ids[i] for i in [child] + cycle[:-1]] + [self.ids[child]]
+                if state[child] == 0:
+                    state[child] = 1
+                    parent[child] = node
+                    stack.append((child, 0))
+        return None
+
+    def strongly_connected_components(self) -> list:
+        """Tarjan's algorithm, iterative. Returns a component number per node."""
+        n = len(self)
+        index, low, component = [-1] * n, [0] * n, [-1] * n
+        on_stack, stack = [False] * n, []
+        counter = components = 0
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            work = [(root, 0)]
+            while work:
+                node, position = work[-1]
+                if position == 0:
+                    index[node] = low[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                neighbours = self.successors(node)
+                if position < len(neighbours):
+                    work[-1] = (node, position + 1)
+                    child = int(neighbours[position])
+                    if index[child] == -1:
+                        work.append((child, 0))
+                    elif on_stack[child]:
+                        low[node] = min(low[node], index[child])
+                    continue
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+        return component
+
+    def topological_order(self, priority=None) -> list:
+        """
+        Kahn's algorithm with a heap: among the nodes whose prerequisites are
+        all placed, the one with the lowest priority goes first. `priority`
+        maps node ids to sort keys (e.g. positions in a proposed sequence);
+        nodes without one come after, in `nodes_id` order. Deterministic for
+        a given input. Raises CycleError when the graph has a cycle.
+        """
+        priority = priority or {}
+        unranked = len(priority)
+        keys = [(priority.get(node_id, unranked), i) for i, node_id in enumerate(self.ids)]
+        in_degree = np.diff(self._in_offsets).tolist()
+        heap = [keys[i] for i in range(len(self)) if in_degree[i] == 0]
+        heapq.heapify(heap)
+
+        order = []
+        while heap:
+            _, node = heapq.heappop(heap)
+            order.append(node)
+            for child in self.successors(node):
+                child = int(child)
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    heapq.heappush(heap, keys[child])
+        if len(order) < len(self):
+            raise CycleError(self.find_cycle())
+        return [self.ids[i] for i in order]
+
+    def is_valid_order(self, sequence) -> bool:
+        """True when `sequence` lists every node once and each prerequisite before its dependents."""
+        if len(sequence) != len(self) or set(sequence) != set(self.ids):
+            return False
+        position = np.empty(len(self), dtype=np.int64)
+        position[[self.index[node_id] for node_id in sequence]] = np.arange(len(self))
+        sources = np.repeat(np.arange(len(self)), np.diff(self._out_offsets))
+        return bool(np.all(position[sources] < position[self._out]))
+
+    def transitive_reduction(self) -> list:
+        """
+        Edges of the transitive reduction of a DAG: an edge u -> v is dropped
+        when v is also reachable from u through another successor. Reachability
+        sets are Python int bitsets built in reverse topological order.
+        Raises CycleError when the graph has a cycle.
+        """
+        order = [self.index[node_id] for node_id in self.topological_order()]
+        reach = [0] * len(self)
+        reduced = []
+        for node in reversed(order):
+            successors = [int(child) for child in self.successors(node)]
+            through_successors = 0
+            for child in successors:
+                through_successors |= reach[child]
+            for child in successors:
+                if not (through_successors >> child) & 1:
+                    reduced.append([self.ids[node], self.ids[child]])
+            reach[node] = through_successors
+            for child in successors:
+                reach[node] |= 1 << child
+        reduced.sort(key=lambda edge: (self.index[edge[0]], self.index[edge[1]]))
+        return reduced
+
+    def _closure(self, node_id, offsets, neighbours) -> list:
+        start = self.index[node_id]
+        seen = np.zeros(len(self), dtype=bool)
+        seen[start] = True
+        frontier = [start]
+        while frontier:
+            following = []
+            for node in frontier:
+                for child in neighbours[offsets[node]:offsets[node + 1]]:
+                    if not seen[child]:
+                        seen[child] = True
+                        following.append(int(child))
+            frontier = following
+        seen[start] = False
+        return [self.ids[i] for i in np.flatnonzero(seen)]
+
+    def prerequisites(self, node_id) -> list:
+        """Every node that must be studied before `node_id`, directly or transitively."""
+        return self._closure(node_id, self._in_offsets, self._in)
+
+    def dependents(self, node_id) -> list:
+        """Every node that requires `node_id`, directly or transitively."""
+        return self._closure(node_id, self._out_offsets, self._out)
+
+
+def break_cycles(graph: DependencyGraph, priority=None) -> list:
+    """
+    Returns the edges of `graph` without those that close a cycle: inside each
+    strongly connected component, edges pointing backwards in the `priority`
+    order (then `nodes_id` order) are dropped, which leaves a DAG.
+    """
+    priority = priority or {}
+    unranked = len(priority)
+    key = {node_id: (priority.get(node_id, unranked), i) for i, node_id in enumerate(graph.ids)}
+    component = graph.strongly_connected_components()
+    return [
+        [source, target] for source, target in graph.edges()
+        if component[graph.index[source]] != component[graph.index[target]] or key[source] < key[target]
+    ]
@@ -0,0 +1,186 @@
+"""
+Batch generation of study graphs for many (student, project) pairs.
+
+Projects are processed concurrently by a bounded worker pool, and graph
+generations are started at most `--rate` per minute so a cohort run stays
+within the LLM quota. Projects whose content fingerprint matches their stored
+graph are skipped without any LLM call. Every finished project is appended to
+a JSON lines report as it completes, so a run can be followed (and its
+failures retried) while it is still going. With `--deadline`, projects not
+started in time are reported as `not_started` instead of overrunning the
+window.
+
+Pairs come from a JSON lines or CSV file (`student_id`, `project_name`), or
+from the `documents_segments` collection, optionally filtered by `--query`.
+
+`--backfill` generates nothing: it writes the node and edge collections of
+graphs saved before those collections existed, and exits.
+
+Usage:
+    python src/study_graph_batch.py --report report.jsonl
+    python src/study_graph_batch.py --pairs cohort.csv --concurrency 16 --rate 120
+    python src/study_graph_batch.py --query '{"project_name": "machine_learning_part-1"}' --deadline 3600
+    python src/study_graph_batch.py --backfill
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from db.client import MongoDBClient
+from agents.study_graph_planner_agent.agent import call_agent, STUDY_GRAPH_VERSION
+from agents.study_graph_planner_agent.planner import (segments_fingerprint, get_fingerprinted_graph,
+                                                      backfill_graph_collections)
+
+STUDY_GRAPH_BATCH_CONCURRENCY = int(os.getenv("STUDY_GRAPH_BATCH_CONCURRENCY", 8))
+# Graph generations started per minute
+STUDY_GRAPH_BATCH_RATE = float(os.getenv("STUDY_GRAPH_BATCH_RATE", 60))
+
+
+class RateLimiter:
+    """
+    Spaces calls at least 1/rate seconds apart across threads. Each caller
+    reserves the next free slot under the lock and sleeps outside it.
+    """
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            slot = max(self._next, time.monotonic())
+            self._next = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def load_pairs(path: str) -> list:
+    """Reads (student_id, project_name) pairs from a JSON lines or CSV file with those columns."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [(int(row["student_id"]), row["project_name"]) for row in rows]
+
+
+def query_pairs(query: dict = None) -> list:
+    """Distinct (student_id, project_name) pairs with segments matching `query`."""
+    segments_col = MongoDBClient().select_collection('documents_segments')
+    rows = segments_col.aggregate([
+        {"$match": query or {}},
+        {"$group": {"_id": {"std_id": "$std_id", "project_name": "$project_name"}}},
+        {"$sort": {"_id.std_id": 1, "_id.project_name": 1}},
+    ], allowDiskUse=True)
+    return [(row["_id"]["std_id"], row["_id"]["project_name"]) for row in rows]
+
+
+class StudyGraphBatch:
+    """
+    Generates the study graphs of `pairs` with `concurrency` workers, starting
+    at most `per_minute` generations per minute. Results are appended to
+    `report_path` (JSON lines) as they complete.
+    """
+
+    def __init__(self, pairs: list, concurrency: int = STUDY_GRAPH_BATCH_CONCURRENCY,
+                 per_minute: float = STUDY_GRAPH_BATCH_RATE, report_path: str = None,
+                 force: bool = False, deadline_seconds: float = None):
+        self.pairs = list(dict.fromkeys(pairs))
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(per_minute / 60.0 if per_minute else 0)
+        self.report_path = report_path
+        self.force = force
+        self.deadline_seconds = deadline_seconds
+        self._report_lock = threading.Lock()
+        self._started = None
+        self.counts = {}
+
+    def _out_of_time(self) -> bool:
+        return bool(self.deadline_seconds) and time.monotonic() - self._started > self.deadline_seconds
+
+    def _generate(self, student_id, project_name) -> dict:
+        if self._out_of_time():
+            return {"status": "not_started"}
+
+        fingerprint = segments_fingerprint(student_id, project_name, STUDY_GRAPH_VERSION)
+        if not self.force and get_fingerprinted_graph(student_id, project_name, fingerprint):
+            return {"status": "skipped"}
+
+        self.rate_limiter.wait()
+        if self._out_of_time():
+            return {"status": "not_started"}
+        query = json.dumps({"student_id": student_id, "project_name": project_name})
+        graph = call_agent(query, force=self.force, fingerprint=fingerprint)
+        if not graph:
+            return {"status": "failed", "error": "no study graph returned"}
+        return {"status": "generated", "nodes": len(graph.get("nodes_id", [])), "edges": len(graph.get("edges", []))}
+
+    def _process(self, student_id, project_name) -> dict:
+        started = time.monotonic()
+        try:
+            outcome = self._generate(student_id, project_name)
+        except Exception as e:
+            outcome = {"status": "failed", "error": str(e)}
+        return {"student_id": student_id, "project_name": project_name, **outcome,
+                "seconds": round(time.monotonic() - started, 2)}
+
+    def _record(self, done: int, result: dict):
+        result["finished_at"] = datetime.now().isoformat()
+        with self._report_lock:
+            self.counts[result["status"]] = self.counts.get(result["status"], 0) + 1
+            if self.report_path:
+                with open(self.report_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result, default=str) + "\n")
+            print(f"[{done}/{len(self.pairs)}] student {result['student_id']} / '{result['project_name']}': "
+                  f"{result['status']}" + (f" ({result['error']})" if result.get("error") else ""))
+
+    def run(self) -> dict:
+        """Processes every pair and returns the number of projects per status."""
+        self._started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._process, student_id, project_name)
+                       for student_id, project_name in self.pairs]
+            for done, future in enumerate(as_completed(futures), 1):
+                self._record(done, future.result())
+
+        elapsed = time.monotonic() - self._started
+        print(f"Processed {len(self.pairs)} projects in {elapsed:.1f}s: {self.counts}")
+        return dict(self.counts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate study graphs for many student projects")
+    parser.add_argument("--pairs", help="JSON lines or CSV file of student_id, project_name pairs")
+    parser.add_argument("--query", help="JSON filter on documents_segments selecting the projects (default: all)")
+    parser.add_argument("--concurrency", type=int, default=STUDY_GRAPH_BATCH_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=STUDY_GRAPH_BATCH_RATE,
+                        help="Maximum graph generations started per minute (0 for no limit)")
+    parser.add_argument("--report", help="JSON lines file the per-project results are appended to")
+    parser.add_argument("--deadline", type=float, default=None,
+                        help="Seconds after which no new generation is started")
+    parser.add_argument("--force", action="store_true", help="Regenerate even when the fingerprint is unchanged")
+    parser.add_argument("--backfill", action="store_true",
+                        help="Write the node and edge collections of previously saved graphs and exit")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill_graph_collections()
+        sys.exit(0)
+    if args.pairs and args.query:
+        parser.error("--pairs and --query are exclusive")
+    pairs = load_pairs(args.pairs) if args.pairs else query_pairs(json.loads(args.query) if args.query else None)
+
+    counts = StudyGraphBatch(pairs, concurrency=args.concurrency, per_minute=args.rate,
+                             report_path=args.report, force=args.force, deadline_seconds=args.deadline).run()
+    sys.exit(1 if counts.get("failed") else 0)
@@ -1,9 +1,20 @@
 import os
+import sys
 from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from google import genai
+from pymongo.errors import OperationFailure
+import numpy as np
 import pprint
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from documents.segment_index import build_segment_filter
+from embeddings import EMBEDDING_MODEL, embed_text
+from singleflight import get_group, make_key
+from cache import TTLCache
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,30 +35,67 @@ db = client[db_name]
 collection = db[collection_name]
 keywords_collection = db[keywords_collection_name]  # Add reference to keywords collection
 
+# Identical concurrent searches share one embedding call and one $vectorSearch
+search_flight = get_group("vector_search")
+
+# Maximum number of $vectorSearch queries run in parallel by get_query_results_many
+VECTOR_SEARCH_CONCURRENCY = int(os.getenv("VECTOR_SEARCH_CONCURRENCY", 8))
+
+# Known topics per (student_id, project_name). Knowledge updates made in this process
+# invalidate the scope right away; the TTL bounds staleness for updates made elsewhere.
+KNOWN_TOPICS_CACHE_TTL = float(os.getenv("KNOWN_TOPICS_CACHE_TTL", 30))
+KNOWN_TOPICS_CACHE_SIZE = int(os.getenv("KNOWN_TOPICS_CACHE_SIZE", 1024))
+known_topics_cache = TTLCache(max_size=KNOWN_TOPICS_CACHE_SIZE, ttl_seconds=KNOWN_TOPICS_CACHE_TTL)
+# Bumped on invalidation so a query that started before an update never repopulates the cache
+_known_topics_generations = {}
+_known_topics_lock = threading.Lock()
+_known_topics_index_ready = False
+
 def get_embedding(text):
-    """Generate embedding for a single text using Google's Gemini model."""
-    # Initialize the genai client
-    genai_client = genai.Client(api_key=google_api_key)
-    
-    # Generate embedding
-    result = genai_client.models.embed_content(
-        model="models/text-embedding-004",
-        contents=text
-    )
-    
-    return result.embeddings[0].values
+    """Generate the query embedding for a single text with the shared embedding service."""
+    return embed_text(text, task_type="RETRIEVAL_QUERY")
+
+def ensure_known_topics_index():
+    """
+    Creates the compound index the known-topics query runs on, once per process.
+    """
+    global _known_topics_index_ready
+    if _known_topics_index_ready:
+        return
+    try:
+        keywords_collection.create_index([("student_id", 1), ("project_name", 1), ("knowledge_level", 1)])
+    except OperationFailure as e:
+        print(f"Could not create known topics index: {e}")
+    _known_topics_index_ready = True
 
-def get_known_topics(knowledge_level_threshold):
+
+def get_known_topics(knowledge_level_threshold, student_id=None, project_name=None):
     """
     Retrieves all topics (keywords) with a knowledge level greater than the specified threshold.
     
     Args:
         knowledge_level_threshold (float): The minimum knowledge level
+        student_id (str, optional): Student the keywords belong to; None selects unscoped keywords
+        project_name (str, optional): Project the keywords belong to; None selects unscoped keywords
         
     Returns:
         list: A list of dictionaries containing known topics and their details
     """
-    query = {"knowledge_level": {"$gt": knowledge_level_threshold}}
+    scope = (student_id, project_name)
+    cached = known_topics_cache.get(scope)
+    if cached is not None and knowledge_level_threshold in cached:
+        return [dict(topic) for topic in cached[knowledge_level_threshold]]
+
+    with _known_topics_lock:
+        generation = _known_topics_generations.get(scope, 0)
+
+    ensure_known_topics_index()
+    # Equality on None also matches keywords saved before they were scoped
+    query = {
+        "student_id": student_id,
+        "project_name": project_name,
+        "knowledge_level": {"$gt": knowledge_level_threshold},
+    }
     
     # Project only the fields we need
     projection = {
@@ -62,23 +110,97 @@ def get_known_topics(knowledge_level_threshold):
     
     # Convert cursor to list
     known_topics = list(results)
+
+    with _known_topics_lock:
+        if _known_topics_generations.get(scope, 0) == generation:
+            cached = known_topics_cache.get(scope) or {}
+            known_topics_cache.set(scope, {**cached, knowledge_level_threshold: known_topics})
     
-    return known_topics
+    return [dict(topic) for topic in known_topics]
+
+
+def invalidate_known_topics(student_id=None, project_name=None):
+    """
+    Drops the cached known topics of a scope; call after changing its knowledge levels.
+    """
+    scope = (student_id, project_name)
+    with _known_topics_lock:
+        _known_topics_generations[scope] = _known_topics_generations.get(scope, 0) + 1
+        known_topics_cache.pop(scope)
 
 # Define a function to run vector search queries
-def get_query_results(query):
-    """Gets results from a vector search query."""
+def get_query_results(query, std_id=None, project_name=None, file_names=None, page_range=None, limit=3,
+                      query_vector=None):
+    """
+    Gets results from a vector search query.
+
+    std_id, project_name, file_names and page_range (first, last; inclusive) are
+    pushed down as a `$vectorSearch` filter, so only matching segments are scored.
+    Segments embedded with another model than the query are always excluded.
+    The Atlas `vector_index` must declare embedding_model, std_id, project_name,
+    file_name and page_number as `filter` fields.
+
+    query_vector: precomputed embedding of `query` (EMBEDDING_MODEL); skips the embedding call.
+    """
+    # Searches with different precomputed vectors must not share a result, even for the same text
+    vector_hash = None
+    if query_vector is not None:
+        vector_hash = hashlib.sha256(np.asarray(query_vector, dtype=np.float64).tobytes()).hexdigest()
+    key = make_key(EMBEDDING_MODEL, {"query": query, "std_id": std_id, "project_name": project_name,
+                                     "file_names": file_names, "page_range": page_range, "limit": limit,
+                                     "query_vector": vector_hash})
+    results = search_flight.do(key, _vector_search, query, std_id, project_name, file_names, page_range, limit,
+                               query_vector)
+    # Each caller gets its own copies, callers may modify the returned documents
+    return [dict(doc) for doc in results]
+
+
+def get_query_results_many(queries, query_vectors=None, max_workers=VECTOR_SEARCH_CONCURRENCY, **filters):
+    """
+    Runs get_query_results for several queries concurrently and returns their
+    results in the same order. Pass query_vectors to reuse embeddings the
+    caller already computed; filters are forwarded to every search.
+    """
+    results = [None] * len(queries)
+    for index, result in iter_query_results(queries, query_vectors, max_workers, **filters):
+        results[index] = result
+    return results
+
+
+def iter_query_results(queries, query_vectors=None, max_workers=VECTOR_SEARCH_CONCURRENCY, **filters):
+    """
+    Same searches as get_query_results_many, yielding (index, results) pairs
+    as soon as each search completes, so callers can stream them.
+    """
+    if not queries:
+        return
+    if query_vectors is None:
+        query_vectors = [None] * len(queries)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(queries)))) as pool:
+        futures = {pool.submit(get_query_results, query, query_vector=vector, **filters): index
+                   for index, (query, vector) in enumerate(zip(queries, query_vectors))}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _vector_search(query, std_id, project_name, file_names, page_range, limit, query_vector=None):
+
+    query_embedding = query_vector if query_vector is not None else get_embedding(query)
+    vector_search = {
+        "index": "vector_index",
+        "queryVector": query_embedding,
+        "path": "embedding",
+        "exact": True,
+        "limit": limit
+    }
+    search_filter = build_segment_filter(std_id=std_id, project_name=project_name,
+                                         file_names=file_names, page_range=page_range,
+                                         embedding_model=EMBEDDING_MODEL)
+    vector_search["filter"] = search_filter
 
-    query_embedding = get_embedding(query)
     pipeline = [
         {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "queryVector": query_embedding,
-                "path": "embedding",
-                "exact": True,
-                "limit": 3
-            }
+            "$vectorSearch": vector_search
         }, {
             "$project": {
                 # "_id": 0,
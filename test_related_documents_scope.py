@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Checks that the related documents of saved keywords are searched within the
+student's and project's segments: the scope must reach the `$vectorSearch`
+filter. MongoDB is replaced by mocks, so no server or API key is needed.
+"""
+import os
+import sys
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "src"))
+
+# The modules connect to Atlas at import time
+with mock.patch("pymongo.mongo_client.MongoClient"):
+    import src.vector_search as vector_search
+    from agents.keywords_finder_agent import agent as keywords_agent
+
+
+def run_save(save, *args, **kwargs):
+    """Runs a save path with mocked collections and returns the $vectorSearch stages it ran."""
+    segments = mock.MagicMock()
+    segments.aggregate.return_value = []
+    keywords = mock.MagicMock()
+    keywords.find.return_value = []
+    with mock.patch.object(vector_search, "collection", segments), \
+            mock.patch.object(keywords_agent, "keywords_collection", keywords):
+        result = save(*args, **kwargs)
+        if not isinstance(result, dict):
+            result = list(result)
+    return [call.args[0][0]["$vectorSearch"] for call in segments.aggregate.call_args_list]
+
+
+def filter_clauses(search):
+    search_filter = search["filter"]
+    return search_filter.get("$and", [search_filter])
+
+
+def test_saved_keywords_search_student_segments():
+    searches = run_save(keywords_agent.save_keywords_with_embeddings, ["svm", "pca"],
+                        [[0.1, 0.2], [0.3, 0.4]], student_id=7, project_name="ml")
+    assert len(searches) == 2
+    for search in searches:
+        clauses = filter_clauses(search)
+        assert {"std_id": {"$eq": 7}} in clauses
+        assert {"project_name": {"$eq": "ml"}} in clauses
+
+
+def test_streamed_keywords_search_like_single_searches():
+    searches = run_save(keywords_agent._stream_save, ["svm", "pca"], [[0.1, 0.2], [0.3, 0.4]], 7, "ml")
+    single = vector_search.build_segment_filter(std_id=7, project_name="ml",
+                                                embedding_model=vector_search.EMBEDDING_MODEL)
+    assert len(searches) == 2
+    assert all(search["filter"] == single for search in searches)
+
+
+def test_unscoped_keywords_search_all_segments():
+    searches = run_save(keywords_agent.save_keywords_with_embeddings, ["svm"], [[0.1, 0.2]])
+    clauses = filter_clauses(searches[0])
+    assert not any("std_id" in clause or "project_name" in clause for clause in clauses)
+
+
+if __name__ == "__main__":
+    test_saved_keywords_search_student_segments()
+    test_streamed_keywords_search_like_single_searches()
+    test_unscoped_keywords_search_all_segments()
+    print("Related documents scope tests passed")
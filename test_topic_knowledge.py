@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Checks the topic knowledge aggregation of the update planning graph agent
+against the MongoDB server of MONGODB_URI (from .env), in a throwaway
+database that is dropped afterwards. Skipped when no server is reachable.
+"""
+import os
+import sys
+
+import pytest
+from pymongo.errors import PyMongoError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from db.client import get_client
+from agents.update_planning_graph_agent import agent as planning_agent
+
+TEST_DB_NAME = f"test_topic_knowledge_{os.getpid()}"
+
+
+@pytest.fixture
+def keywords_col(monkeypatch):
+    if not os.getenv("MONGODB_URI"):
+        pytest.skip("MONGODB_URI is not set")
+    client = get_client()
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB is not reachable: {e}")
+    monkeypatch.setenv("MONGODB_DB_NAME", TEST_DB_NAME)
+    monkeypatch.setenv("MONGODB_COLLECTION_NAME", "test1")
+    yield client[TEST_DB_NAME]["keywords"]
+    client.drop_database(TEST_DB_NAME)
+
+
+def test_topics_fall_back_to_unscoped_keywords(keywords_col):
+    keywords_col.insert_many([
+        # the student's own keyword wins over the unscoped ones
+        {"student_id": 7, "project_name": "ml", "keyword": "svm", "knowledge_level": 0.6},
+        {"student_id": None, "project_name": None, "keyword": "svm", "knowledge_level": 0.9},
+        {"keyword": "svm", "knowledge_level": 1.0},
+        # no keyword of the student: unscoped and legacy (unscoped fields missing) keywords are used
+        {"student_id": None, "project_name": "ml", "keyword": "pca", "knowledge_level": 0.2},
+        {"keyword": "pca", "knowledge_level": 0.4},
+        # other students' keywords are never used
+        {"student_id": 8, "project_name": "ml", "keyword": "svm", "knowledge_level": 0.1},
+        {"student_id": 8, "project_name": "ml", "keyword": "knn", "knowledge_level": 1.0},
+    ])
+
+    knowledge = planning_agent.get_keywords(["svm", "pca", "knn"], 7, "ml")
+
+    assert [(entry["keyword"], round(entry["knowledge_level"], 6)) for entry in knowledge] == [
+        ("svm", 0.6), ("pca", 0.3), ("pca", 0.2),
+    ]
+
+
+def test_unscoped_request_uses_unscoped_keywords(keywords_col):
+    keywords_col.insert_many([
+        {"student_id": None, "project_name": None, "keyword": "svm", "knowledge_level": 0.8},
+        {"student_id": 8, "project_name": "ml", "keyword": "svm", "knowledge_level": 0.1},
+    ])
+
+    knowledge = planning_agent.get_keywords(["svm"])
+
+    assert knowledge == [{"keyword": "svm", "knowledge_level": 0.8}]
+
+
+def test_knowledge_base_uses_unscoped_keywords(keywords_col):
+    students_col = keywords_col.database["test1"]
+    students_col.insert_one({"student_id": None, "project_name": "ml", "known_topics": ["SVM", "pca"]})
+    keywords_col.insert_many([
+        {"student_id": None, "project_name": "ml", "keyword": "svm", "knowledge_level": 0.95},
+        {"keyword": "pca", "knowledge_level": 0.5},
+        {"student_id": 8, "project_name": "ml", "keyword": "pca", "knowledge_level": 1.0},
+    ])
+
+    knowledge_base = planning_agent.update_student_knowledge_base(None, "ml")
+
+    assert knowledge_base == [
+        {"topic": "svm", "score": 0.95, "status": "Completed"},
+        {"topic": "pca", "score": 0.5, "status": "Need Improvement"},
+    ]
+    assert students_col.find_one({"project_name": "ml"})["student_knowledge_base"] == knowledge_base